@@ -0,0 +1,92 @@
+import torch
+from torch.utils.data import Sampler
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data.dataloader import default_collate
+import random
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler which groups samples with captions of similar length in the same batch.
+    Each epoch the samples are shuffled and split in buckets of bucket_size_multiplier batches;
+    the samples of a bucket are sorted by caption length and cut in batches, and the batches are shuffled.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size_multiplier=100, shuffle=True, drop_last=False):
+        """
+        Args:
+            lengths (list): caption length of every sample of the dataset.
+            batch_size (int): number of samples per batch.
+            bucket_size_multiplier (int): number of batches in each bucket.
+            shuffle (bool): shuffle samples and batches every epoch.
+            drop_last (bool): drop the last batch of each bucket if it is smaller than batch_size.
+        """
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            random.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda idx: self.lengths[idx], reverse=True)
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batch = bucket[batch_start:batch_start + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append(batch)
+
+        if self.shuffle:
+            random.shuffle(batches)
+
+        return iter(batches)
+
+    def __len__(self):
+        nr_batches = 0
+        for start in range(0, len(self.lengths), self.bucket_size):
+            bucket_size = min(self.bucket_size, len(self.lengths) - start)
+            if self.drop_last:
+                nr_batches += bucket_size // self.batch_size
+            else:
+                nr_batches += (bucket_size + self.batch_size - 1) // self.batch_size
+        return nr_batches
+
+
+class PadCollate(object):
+    """
+    Collate function which pads the captions of a batch only up to the longest caption of the batch.
+    Optionally sorts the batch by decreasing caption length, so that the decoders can skip their sort.
+    The fields which follow (image, caption, length, study), e.g. the sentence store reports of the
+    HierarchicalXRayDataset, are collated as by the default collate function.
+    """
+
+    def __init__(self, padIdx, sort=False):
+        """
+        Args:
+            padIdx (int): index of the <pad> token.
+            sort (bool): sort the samples of the batch by decreasing caption length.
+        """
+        self.padIdx = padIdx
+        self.sort = sort
+
+    def __call__(self, batch):
+        if self.sort:
+            batch = sorted(batch, key=lambda sample: sample[2], reverse=True)
+
+        fields = list(zip(*batch))
+        images, captions, lengths, studies = fields[:4]
+
+        lengths = torch.LongTensor(lengths)
+        captions = pad_sequence(captions, batch_first=True, padding_value=self.padIdx)
+        # Captions padded by the dataset are cut at the longest caption of the batch
+        captions = captions[:, :int(lengths.max())]
+
+        # Sentence store reports are padded to the same size by the store
+        extra = tuple(default_collate(list(field)) for field in fields[4:])
+
+        return (torch.stack(images, 0), captions, lengths, studies) + extra
@@ -1,5 +1,6 @@
 import torch
 from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
 import json
 import os
 from PIL import Image
@@ -7,41 +8,68 @@ import re
 import sys
 sys.path.append('../Utils/')
 import pandas as pd
+import numpy as np
 
 from generalUtilities import *
+from imageShards import *
+
+
+MISSING_LABEL = 2
 
 
 class ClassXRayDataset(Dataset):
     """MIMIC xray dataset."""
 
 
-    def __init__(self, imgsDir, labels_csv_path, transform=None):
+    def __init__(self, imgsDir, labels_csv_path, transform=None, manifestPath=None, shardsPath=None):
         """
         Args:
             json_file (string): Path to the json file with captions.
             root_dir (string): Directory with all the images.
             transform (callable, optional): Optional transform to be applied
                 on a sample.
+            manifestPath (string, optional): Path to the image manifest built by buildImageManifest,
+                used instead of walking root_dir.
+            shardsPath (string, optional): Directory of the image shards built by buildImageShards.
         """
 
         self.imgsDir = imgsDir
         self.transform = transform
-        self.imgPaths = getFilesInDirectory(imgsDir)
-        self.labels = pd.read_csv(labels_csv_path, index_col = 0)
 
+        self.imageShards = None
+        if shardsPath:
+            self.imageShards = ImageShards(shardsPath)
+            self.imgStudies = self.imageShards.studies
+        else:
+            self.imgPaths, self.imgStudies = loadImageManifest(imgsDir, manifestPath)
+
+        self.labels = self.loadLabels(labels_csv_path)
+
+
+    def loadLabels(self, labels_csv_path):
+        """
+        Dense int8 array with the labels of each image, aligned with the images; missing labels are set to
+        MISSING_LABEL
+        """
+        labels = pd.read_csv(labels_csv_path, index_col = 0).iloc[:, 1:]
+        missing_studies = np.setdiff1d(self.imgStudies, labels.index.values)
+        if len(missing_studies) > 0:
+            raise KeyError("Studies without labels: " + str(missing_studies[:10]))
+
+        labels = labels.reindex(self.imgStudies).values
+        return np.where(np.isnan(labels), MISSING_LABEL, labels).astype(np.int8)
 
     def __len__(self):
-        return len(self.imgPaths)
+        return len(self.imgStudies)
 
     def __getitem__(self, idx):
 
-        imgID = self.imgPaths[idx]
-        study = re.findall(r"s\d{8}", imgID)[0][1:]
-
-        image = Image.open(imgID)
+        labels = torch.from_numpy(self.labels[idx])
 
-        labels =  torch.tensor(self.labels.loc[int(study)].values[1:], dtype=torch.long)
+        if self.imageShards is not None:
+            return torch.from_numpy(np.array(self.imageShards.getImage(idx))), labels
 
+        image = Image.open(str(self.imgPaths[idx]))
 
         if self.transform:
             image = self.transform(image)
@@ -49,3 +77,9 @@ class ClassXRayDataset(Dataset):
         return image, labels
 
 
+def collate_class_batch(batch):
+    """
+    Collate images and labels, expanding the labels into the soft two column targets used by the classifier
+    """
+    images, labels = default_collate(batch)
+    return images, reshape_target_labels(labels)
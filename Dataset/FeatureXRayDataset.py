@@ -0,0 +1,52 @@
+import torch
+import numpy as np
+import sys
+sys.path.append('../Utils/')
+
+from XRayDataset import *
+from featureStore import *
+
+
+class FeatureXRayDataset(XRayDataset):
+    """MIMIC xray dataset which returns the images already encoded, read from an offline feature store."""
+
+
+    def __init__(self, word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, featureStorePath, maxSize = 372,
+                 padCaptions=True, captionStorePath=None):
+        """
+        Args:
+            word2idx_path (string): Path to the json file with word -> index correspondence.
+            encodedCaptionsJsonFile (string): Path to the json file with captions.
+            captionsLengthsFile (string): Path to the json file with captions lengths.
+            featureStorePath (string): Directory of the feature store built by buildFeatureStore.
+            padCaptions (bool): pad captions to maxSize; if False they are padded per batch by PadCollate
+            captionStorePath (string, optional): Directory of a caption store built by buildCaptionStore,
+                read instead of the json files.
+        """
+
+        self.loadCaptions(word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, maxSize, padCaptions,
+                          captionStorePath)
+
+        self.featureStorePath = featureStorePath
+        _, self.studies = loadFeatureStore(featureStorePath)
+
+        # The memory map is opened by each worker in its first access
+        self.features = None
+
+    def __len__(self):
+        return len(self.studies)
+
+    def getStudy(self, idx):
+        return str(self.studies[idx])
+
+    def __getitem__(self, idx):
+        if self.features is None:
+            self.features, _ = loadFeatureStore(self.featureStorePath)
+
+        study = self.getStudy(idx)
+
+        features = torch.from_numpy(np.array(self.features[idx]))
+
+        encodedCaption, encodedCaptionLength = self.getEncodedCaption(study)
+
+        return features, encodedCaption, encodedCaptionLength, study
@@ -0,0 +1,33 @@
+import torch
+import numpy as np
+import sys
+sys.path.append('../Utils/')
+
+from XRayDataset import *
+from hierarchicalSentences import *
+
+
+class HierarchicalXRayDataset(XRayDataset):
+    """MIMIC xray dataset which also returns the sentence split report of each study, read from a sentence store."""
+
+
+    def __init__(self, word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, imgsDir, sentenceStorePath,
+                 transform=None, maxSize = 372, padCaptions=True, captionStorePath=None, manifestPath=None, shardsPath=None):
+        """
+        Args:
+            sentenceStorePath (string): Directory of the sentence store built by buildSentenceStore.
+            The other arguments are the ones of XRayDataset.
+        """
+        super(HierarchicalXRayDataset, self).__init__(word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile,
+            imgsDir, transform, maxSize, padCaptions, captionStorePath, manifestPath, shardsPath)
+
+        # The memory maps are opened by each worker in its first access
+        self.sentenceStore = SentenceStore(sentenceStorePath)
+
+    def __getitem__(self, idx):
+        image, encodedCaption, encodedCaptionLength, study = super(HierarchicalXRayDataset, self).__getitem__(idx)
+
+        sentences, sentencesLengths, reportLength = self.sentenceStore.getReport(study)
+
+        return image, encodedCaption, encodedCaptionLength, study, torch.from_numpy(sentences), \
+               torch.from_numpy(sentencesLengths), int(reportLength)
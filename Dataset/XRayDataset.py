@@ -2,6 +2,7 @@ import torch
 from torch.utils.data import Dataset
 import json
 import os
+import numpy as np
 from PIL import Image
 import re
 import sys
@@ -9,45 +10,98 @@ sys.path.append('../Utils/')
 
 
 from generalUtilities import *
+from captionStore import *
+from imageShards import *
 
 
 class XRayDataset(Dataset):
     """MIMIC xray dataset."""
 
 
-    def __init__(self,word2idx_path,  encodedCaptionsJsonFile, captionsLengthsFile, imgsDir, transform=None, maxSize = 372):
+    def __init__(self,word2idx_path,  encodedCaptionsJsonFile, captionsLengthsFile, imgsDir, transform=None, maxSize = 372,
+                 padCaptions=True, captionStorePath=None, manifestPath=None, shardsPath=None):
         """
         Args:
             json_file (string): Path to the json file with captions.
             root_dir (string): Directory with all the images.
             transform (callable, optional): Optional transform to be applied
                 on a sample.
+            padCaptions (bool): pad captions to maxSize; if False they are padded per batch by PadCollate
+            captionStorePath (string, optional): Directory of a caption store built by buildCaptionStore,
+                read instead of the json files.
+            manifestPath (string, optional): Path to the image manifest built by buildImageManifest,
+                used instead of walking root_dir.
+            shardsPath (string, optional): Directory of the image shards built by buildImageShards.
         """
 
+        self.loadCaptions(word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, maxSize, padCaptions,
+                          captionStorePath)
+
+        self.imgsDir = imgsDir
+        self.transform = transform
+
+        self.imageShards = None
+        if shardsPath:
+            self.imageShards = ImageShards(shardsPath)
+            self.imgStudies = self.imageShards.studies
+        else:
+            self.imgPaths, self.imgStudies = loadImageManifest(imgsDir, manifestPath)
+
+    def loadCaptions(self, word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, maxSize, padCaptions=True,
+                     captionStorePath=None):
         with open(word2idx_path) as json_file:
             self.word2idx = json.load(json_file)
 
-        with open(encodedCaptionsJsonFile) as json_file:
-            self.encodedCaptions = json.load(json_file)
+        self.captionStore = None
+        if captionStorePath:
+            self.captionStore = CaptionStore(captionStorePath)
+            self.nrCaptions = len(self.captionStore)
+        else:
+            with open(encodedCaptionsJsonFile) as json_file:
+                self.encodedCaptions = json.load(json_file)
 
-        with open(captionsLengthsFile) as json_file:
-            self.encodedCaptionsLength = json.load(json_file)
+            with open(captionsLengthsFile) as json_file:
+                self.encodedCaptionsLength = json.load(json_file)
+
+            self.nrCaptions = len(self.encodedCaptions)
 
-        self.imgsDir = imgsDir
-        self.transform = transform
-        self.imgPaths = getFilesInDirectory(imgsDir)
         self.maxSize = maxSize
+        self.padCaptions = padCaptions
         self.vocab_size = len(self.word2idx.keys())
 
     def __len__(self):
-        return len(self.encodedCaptions)
+        return self.nrCaptions
 
     def __getitem__(self, idx):
 
-        imgID = self.imgPaths[idx]
-        study = re.findall(r"s\d{8}", imgID)[0][1:]
+        study = self.getStudy(idx)
+
+        encodedCaption, encodedCaptionLength = self.getEncodedCaption(study)
+
+        if self.imageShards is not None:
+            return torch.from_numpy(np.array(self.imageShards.getImage(idx))), encodedCaption, encodedCaptionLength, study
 
-        image = Image.open(imgID)
+        image = Image.open(str(self.imgPaths[idx]))
+
+        if self.transform:
+            image = self.transform(image)
+
+        return image,  encodedCaption, encodedCaptionLength, study
+
+    def getStudy(self, idx):
+        return '%08d' % self.imgStudies[idx]
+
+    # Length of the encoded caption (with start and end of caption tokens) of every sample,
+    # used to group samples of similar length in the same batch
+    def getCaptionLengths(self):
+        if self.captionStore is not None:
+            return [self.captionStore.getLength(self.getStudy(idx)) for idx in range(len(self))]
+        return [self.encodedCaptionsLength[self.getStudy(idx)] + 2 for idx in range(len(self))]
+
+    # Encoded and padded caption of a study, with start and end of caption tokens
+    def getEncodedCaption(self, study):
+        if self.captionStore is not None:
+            return self.getStoredCaption(study)
 
         encodedCaptionLength = 0
         encodedCaption = []
@@ -65,13 +119,25 @@ class XRayDataset(Dataset):
         encodedCaption.append(self.word2idx['<eoc>'])
 
         # Pad captions until all have max_size
-        encodedCaption = self.padCaption(torch.LongTensor(encodedCaption), self.maxSize, encodedCaptionLength)
+        if self.padCaptions:
+            encodedCaption = self.padCaption(torch.LongTensor(encodedCaption), self.maxSize, encodedCaptionLength)
+        else:
+            encodedCaption = torch.LongTensor(encodedCaption)
 
+        return encodedCaption, encodedCaptionLength
 
-        if self.transform:
-            image = self.transform(image)
+    # Encoded caption of a study read from the caption store
+    def getStoredCaption(self, study):
+        tokens = self.captionStore.getCaption(study)
+        encodedCaptionLength = len(tokens)
+
+        if self.padCaptions:
+            encodedCaption = torch.full([self.maxSize], self.word2idx['<pad>'], dtype=torch.long)
+        else:
+            encodedCaption = torch.empty(encodedCaptionLength, dtype=torch.long)
+        encodedCaption[:encodedCaptionLength] = torch.from_numpy(tokens.astype(np.int64))
 
-        return image,  torch.LongTensor(encodedCaption), encodedCaptionLength, study
+        return encodedCaption, encodedCaptionLength
 
 
     # Transform caption comprised of list of words into
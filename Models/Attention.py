@@ -21,15 +21,27 @@ class Attention(nn.Module):
         self.relu = nn.ReLU()
         self.softmax = nn.Softmax(dim=1)  # softmax layer to calculate weights
 
-    def forward(self, encoder_out, decoder_hidden):
+    def project_encoder(self, encoder_out):
+        """
+        Projects the encoded images into the attention space. Since the encoded images do not change while a caption
+        is decoded, this only needs to be done once per image and can be reused (and reindexed) at every timestep.
+        :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
+        :return: projected encoded images, a tensor of dimension (batch_size, num_pixels, attention_dim)
+        """
+        return self.encoder_att(encoder_out)
+
+    def forward(self, encoder_out, decoder_hidden, projected_encoder_out=None):
         """
         Forward propagation.
         :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
         :param decoder_hidden: previous decoder output, a tensor of dimension (batch_size, decoder_dim)
+        :param projected_encoder_out: encoded images projected by project_encoder, computed here if not provided
         :return: attention weighted encoding, weights
         """
         #print("ENC OUT shape",encoder_out.shape)
-        att1 = self.encoder_att(encoder_out)  # (batch_size, num_pixels, attention_dim)
+        if projected_encoder_out is None:
+            projected_encoder_out = self.project_encoder(encoder_out)
+        att1 = projected_encoder_out  # (batch_size, num_pixels, attention_dim)
         #print("IMG ATT1:", att1.shape)
         att2 = self.decoder_att(decoder_hidden)  # (batch_size, attention_dim)
         att = self.full_att(self.relu(att1 + att2.unsqueeze(1))).squeeze(2)  # (batch_size, num_pixels)
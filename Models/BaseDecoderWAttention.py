@@ -1,11 +1,13 @@
 import json
 import torch
 from torch import nn
+import torch.nn.functional as F
 import torchvision
 from Attention import Attention
 from DotProdAttention import *
 from abc import ABC, abstractmethod
 from MogrifierLSTM import *
+from NearestWordIndex import NearestWordIndex
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -102,6 +104,56 @@ class BaseDecoderWAttention(nn.Module):
         c = self.init_c(mean_encoder_out)
         return h, c
 
+    def nearest_words(self):
+        """
+        Nearest word index over the current embeddings, built on first use and rebuilt only when the
+        embeddings change.
+        :return: NearestWordIndex
+        """
+        if getattr(self, 'nearest_word_index', None) is None:
+            self.nearest_word_index = NearestWordIndex(self.embedding.weight)
+        else:
+            self.nearest_word_index.update(self.embedding.weight)
+        return self.nearest_word_index
+
+    def use_input_projection(self):
+        """
+        Every input word is known in advance with teacher forcing and no scheduled sampling, so the embedding
+        part of the LSTM gates can be computed for all the time steps at once (only for the plain LSTMCell).
+        """
+        return self.use_tf_as_input == 1 and not (self.use_scheduled_sampling and self.scheduled_sampling_prob > 0) \
+            and isinstance(self.decode_step, nn.LSTMCell)
+
+    def project_inputs(self, inputs):
+        """
+        Contribution of the input embeddings to the LSTM gates, in a single matrix multiplication.
+        :param inputs: input embeddings of all the time steps, a tensor of dimension (batch_size, steps, embed_dim)
+        :return: input part of the gates with the LSTM biases, a tensor of dimension (batch_size, steps, 4 * decoder_dim),
+            weights of the remaining (attention weighted encoding, hidden state) part of the gates
+        """
+        projected_inputs = F.linear(inputs, self.decode_step.weight_ih[:, :self.embed_dim],
+                                    self.decode_step.bias_ih + self.decode_step.bias_hh)
+        # Stored transposed once per sequence, which multiplies faster than the transposed view at every step
+        recurrent_weight = torch.cat([self.decode_step.weight_ih[:, self.embed_dim:], self.decode_step.weight_hh],
+                                     dim=1).t().contiguous()  # (encoder_dim + decoder_dim, 4 * decoder_dim)
+        return projected_inputs, recurrent_weight
+
+    def projected_decode_step(self, projected_input, attention_weighted_encoding, state, recurrent_weight):
+        """
+        One step of the decoding LSTMCell, given the contribution of its input embedding to the gates.
+        :param projected_input: input part of the gates, from project_inputs, (batch_size_t, 4 * decoder_dim)
+        :param attention_weighted_encoding: gated attention weighted encoding, (batch_size_t, encoder_dim)
+        :param state: hidden state, cell state
+        :param recurrent_weight: weights of the remaining part of the gates, from project_inputs
+        :return: hidden state, cell state
+        """
+        h, c = state
+        gates = torch.addmm(projected_input, torch.cat([attention_weighted_encoding, h], dim=1), recurrent_weight)
+        input_gate, forget_gate, cell_gate, output_gate = gates.chunk(4, 1)
+        c = torch.sigmoid(forget_gate) * c + torch.sigmoid(input_gate) * torch.tanh(cell_gate)
+        h = torch.sigmoid(output_gate) * torch.tanh(c)
+        return h, c
+
     def set_teacher_forcing_usage(self, value):
         self.use_tf_as_input = value
 
@@ -155,6 +155,57 @@ class BaseHierarchicalDecoder(nn.Module):
         c_word = torch.zeros(batch_size, self.hidden_dim, requires_grad = True).to(device)
         return h_word, c_word
 
+    def sentence_step(self, encoder_out, projected_encoder_out, h_sent, c_sent):
+        """
+        One step of the sentence LSTM: attends the image, updates the sentence state and outputs the topic
+        vector of the next sentence and the logit of stopping the report before it.
+        :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
+        :param projected_encoder_out: encoded images projected by the visual attention, (batch_size, num_pixels, attention_dim)
+        :param h_sent: hidden state of the sentence LSTM, (batch_size, hidden_dim)
+        :param c_sent: cell state of the sentence LSTM, (batch_size, hidden_dim)
+        :return: topic vector (batch_size, embed_dim), stop logit (batch_size, 1), hidden state, cell state
+        """
+        attention_weighted_visual_encoding, _ = self.visual_attention(encoder_out, h_sent, projected_encoder_out)
+
+        context_vector = self.context_vector_fc(attention_weighted_visual_encoding)
+
+        prev_h_sent = h_sent
+
+        h_sent, c_sent = self.sentence_decoder(context_vector, (h_sent, c_sent))
+
+        topic_vector = self.topic_vector(self.tanh(self.context_vector_W_h_t(h_sent) + self.context_vector_W(context_vector)))
+
+        stop_prob = self.stop(self.tanh(self.stop_h_1(prev_h_sent) + self.stop_h(h_sent)))
+
+        return topic_vector, stop_prob, h_sent, c_sent
+
+    def generate_topics(self, encoder_out, max_report_length):
+        """
+        Runs the sentence LSTM over a batch of reports. A report ends at the first step whose stop probability
+        is above 0.5: the sentence of that step and the following ones are not generated.
+        :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
+        :param max_report_length: maximum number of sentences per report
+        :return: topic vectors (batch_size, max_report_length, embed_dim),
+            mask of the generated sentences (batch_size, max_report_length)
+        """
+        batch_size = encoder_out.size(0)
+
+        # Project the encoded images into the visual attention space once per report
+        projected_encoder_out = self.visual_attention.project_encoder(encoder_out)  # (batch_size, num_pixels, attention_dim)
+
+        h_sent, c_sent = self.init_sent_hidden_state(batch_size)
+
+        topic_vectors = []
+        stops = []
+        for t_s in range(max_report_length):
+            topic_vector, stop_prob, h_sent, c_sent = self.sentence_step(encoder_out, projected_encoder_out, h_sent, c_sent)
+            topic_vectors.append(topic_vector)
+            stops.append(torch.sigmoid(stop_prob).squeeze(1) > 0.5)
+
+        # A sentence is generated if no stop was predicted up to its step
+        generated = torch.stack(stops, dim=1).long().cumsum(dim=1) == 0  # (batch_size, max_report_length)
+
+        return torch.stack(topic_vectors, dim=1), generated
 
 
     def set_teacher_forcing_usage(self, value):
@@ -7,6 +7,8 @@ import torchvision
 import torch.nn.functional as F
 from efficientnet_pytorch import EfficientNet
 
+from ImageNormalization import ImageNormalization
+
 
 
 class ClassifyingEncoder(nn.Module):
@@ -20,6 +22,9 @@ class ClassifyingEncoder(nn.Module):
         self.network_name= network_name
         self.nr_classes = 28
 
+        # Channel replication and ImageNet normalization of the uint8 grayscale images
+        self.input_normalization = ImageNormalization()
+
 
         if self.network_name == 'densenet121':
             self.dim = 1024
@@ -40,9 +45,11 @@ class ClassifyingEncoder(nn.Module):
     def forward(self, images):
         """
         Forward propagation.
-        :param images: images, a tensor of dimensions (batch_size, 3, image_size, image_size)
+        :param images: uint8 images, a tensor of dimensions (batch_size, 1, image_size, image_size)
         :return: encoded images
         """
+        images = self.input_normalization(images)  # (batch_size, 3, image_size, image_size)
+
         if self.network_name == "efficient_net":
             class_preds_logits = self.net(img)
             #with torch.no_grad():
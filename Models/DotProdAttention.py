@@ -22,33 +22,32 @@ class DotProdAttention(nn.Module):
 
 
 
-    def forward(self, encoder_out, decoder_hidden):
+    def project_encoder(self, encoder_out):
+        """
+        Computes the keys and values of the encoded images, which only needs to be done once per image.
+        :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
+        :return: keys and values concatenated, a tensor of dimension (batch_size, num_pixels, 2 * encoder_dim)
+        """
+        return torch.cat([self.k_linear(encoder_out), self.v_linear(encoder_out)], dim=2)
+
+    def forward(self, encoder_out, decoder_hidden, projected_encoder_out=None):
         """
         Forward propagation.
         :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
         :param decoder_hidden: previous decoder output, a tensor of dimension (batch_size, decoder_dim)
+        :param projected_encoder_out: encoded images projected by project_encoder, computed here if not provided
         :return: attention weighted encoding, weights
         """
-        k = self.k_linear(encoder_out)
-        print("k shape", k.shape)
+        if projected_encoder_out is None:
+            projected_encoder_out = self.project_encoder(encoder_out)
+        k, v = projected_encoder_out.chunk(2, dim=2)
 
-        v = self.v_linear(encoder_out)
-        print("v shape", v.shape)
         q = self.q_linear(decoder_hidden)
-        print("q shape", q.shape)
 
         d_k = encoder_out.shape[2]
-        print("Q uns",q.unsqueeze(1).shape)
 
         alphas = torch.matmul(q.unsqueeze(1), k.transpose(-2, -1)) /  math.sqrt(d_k)
-        print(alphas.shape)
-        alphas = self.softmax(alphas)
-        awe = torch.matmul(alphas, v).squeeze(1)
-        print("awe", awe.shape)
-
-
+        alphas = self.softmax(alphas.squeeze(1))  # (batch_size, num_pixels)
+        attention_weighted_encoding = torch.matmul(alphas.unsqueeze(1), v).squeeze(1)  # (batch_size, encoder_dim)
 
         return attention_weighted_encoding, alphas
-
-
-
@@ -0,0 +1,29 @@
+import torch
+from torch import nn
+
+
+class ImageNormalization(nn.Module):
+    """
+    Front of the encoders: turns batches of uint8 grayscale images into the normalized 3 channel float images
+    expected by networks pre-trained on ImageNet, as ToTensor + Normalize did per image in the data loaders.
+    """
+
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        super(ImageNormalization, self).__init__()
+        # Not persistent, so that checkpoints saved before the normalization moved into the encoder still load
+        self.register_buffer('mean', torch.tensor(mean).view(1, 3, 1, 1), persistent=False)
+        self.register_buffer('std', torch.tensor(std).view(1, 3, 1, 1), persistent=False)
+
+    def forward(self, images):
+        """
+        Forward propagation.
+        :param images: uint8 images, a tensor of dimensions (batch_size, 1, image_size, image_size);
+            float images are assumed to be already normalized and returned as they are
+        :return: normalized images, a tensor of dimensions (batch_size, 3, image_size, image_size)
+        """
+        if images.dtype != torch.uint8:
+            return images
+
+        images = images.float().div_(255)
+        # Replicate the grayscale channel, broadcast against the per channel statistics
+        return (images.expand(-1, 3, -1, -1) - self.mean) / self.std
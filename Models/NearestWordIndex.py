@@ -0,0 +1,108 @@
+import torch
+import torch.nn.functional as F
+
+
+PRECISIONS = ['fp32', 'fp16', 'int8']
+
+
+class NearestWordIndex(object):
+    """
+    Nearest word lookup for continuous outputs. The embeddings matrix is L2 normalized once, so that the
+    similarity of a block of outputs with every word of the vocabulary is a single matrix product (cosine
+    similarity). The matrix can be kept in fp16, or in int8 with a scale per word, to reduce its size.
+    """
+
+    def __init__(self, embeddings, precision='fp32', chunk_size=4096):
+        """
+        :param embeddings: embeddings matrix, a tensor of dimension (vocab_size, embed_dim)
+        :param precision: 'fp32', 'fp16' or 'int8', storage precision of the normalized embeddings
+        :param chunk_size: maximum number of outputs compared with the vocabulary at once
+        """
+        if precision not in PRECISIONS:
+            raise ValueError("Unknown precision " + str(precision) + ", expected one of " + str(PRECISIONS))
+
+        self.precision = precision
+        self.chunk_size = chunk_size
+        self.source = None
+        self.source_version = None
+        self.update(embeddings)
+
+    def update(self, embeddings):
+        """
+        Rebuilds the index if the embeddings changed since it was built (e.g. fine-tuned embeddings after an
+        optimizer step), otherwise does nothing.
+        :param embeddings: embeddings matrix, a tensor of dimension (vocab_size, embed_dim)
+        """
+        if self.source is embeddings and self.source_version == embeddings._version:
+            return
+
+        self.source = embeddings
+        self.source_version = embeddings._version
+
+        with torch.no_grad():
+            weight = F.normalize(embeddings.detach().float(), p=2, dim=1)  # (vocab_size, embed_dim)
+
+            if self.precision == 'int8':
+                # Symmetric quantization with one scale per word
+                self.scale = weight.abs().max(dim=1)[0].clamp(min=1e-12) / 127.  # (vocab_size)
+                self.weight = torch.round(weight / self.scale.unsqueeze(1)).to(torch.int8)
+            elif self.precision == 'fp16':
+                self.scale = None
+                self.weight = weight.half()
+            else:
+                self.scale = None
+                self.weight = weight
+
+    def __getstate__(self):
+        # The index is rebuilt from the embeddings after unpickling instead of being saved with the model
+        state = self.__dict__.copy()
+        state.update(source=None, source_version=None, weight=None, scale=None)
+        return state
+
+    def scores(self, queries):
+        """
+        Cosine similarity of continuous outputs with every word of the vocabulary
+        :param queries: continuous outputs, a tensor of dimension (..., embed_dim)
+        :return: similarities, a tensor of dimension (..., vocab_size)
+        """
+        shape = queries.shape[:-1]
+        queries = F.normalize(queries.detach().reshape(-1, queries.size(-1)).float(), p=2, dim=1)
+
+        if self.precision == 'int8':
+            scores = torch.mm(queries, self.weight.float().t()) * self.scale
+        elif self.precision == 'fp16':
+            scores = torch.mm(queries.half(), self.weight.t()).float()
+        else:
+            scores = torch.mm(queries, self.weight.t())
+
+        return scores.view(*shape, -1)
+
+    def topk(self, queries, k=1):
+        """
+        Nearest k words of each continuous output. The outputs are compared with the vocabulary in chunks of
+        chunk_size rows, so a whole (batch_size, max_length, embed_dim) block can be queried at once.
+        :param queries: continuous outputs, a tensor of dimension (..., embed_dim)
+        :param k: number of words per output
+        :return: similarities and indexes of the nearest words, tensors of dimension (..., k)
+        """
+        shape = queries.shape[:-1]
+        queries = queries.reshape(-1, queries.size(-1))
+
+        values, indices = [], []
+        for start in range(0, queries.size(0), self.chunk_size):
+            chunk_values, chunk_indices = self.scores(queries[start:start + self.chunk_size]).topk(k, dim=1)
+            values.append(chunk_values)
+            indices.append(chunk_indices)
+
+        if not values:
+            return queries.new_zeros(*shape, k), torch.zeros(*shape, k, dtype=torch.long, device=queries.device)
+
+        return torch.cat(values).view(*shape, k), torch.cat(indices).view(*shape, k)
+
+    def nearest(self, queries):
+        """
+        Index of the nearest word of each continuous output
+        :param queries: continuous outputs, a tensor of dimension (..., embed_dim)
+        :return: word indexes, a tensor of dimension (...)
+        """
+        return self.topk(queries, 1)[1].squeeze(-1)
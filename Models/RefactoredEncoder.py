@@ -2,6 +2,8 @@ import torch
 from torch import nn
 import torchvision
 
+from ImageNormalization import ImageNormalization
+
 
 class RefactoredEncoder(nn.Module):
     """
@@ -12,6 +14,9 @@ class RefactoredEncoder(nn.Module):
         super(RefactoredEncoder, self).__init__()
         self.network_name = network_name
 
+        # Channel replication and ImageNet normalization of the uint8 grayscale images
+        self.input_normalization = ImageNormalization()
+
         if self.network_name == 'resnet101':
             resnet = torchvision.models.resnet101(pretrained=True)  # pretrained ImageNet ResNet-101
             modules = list(resnet.children())[:-2]
@@ -33,9 +38,10 @@ class RefactoredEncoder(nn.Module):
     def forward(self, images):
         """
         Forward propagation.
-        :param images: images, a tensor of dimensions (batch_size, 3, image_size, image_size)
+        :param images: uint8 images, a tensor of dimensions (batch_size, 1, image_size, image_size)
         :return: encoded images
         """
+        images = self.input_normalization(images)  # (batch_size, 3, image_size, image_size)
         out = self.net(images)  # (batch_size, 2048, image_size/32, image_size/32)
         #out = self.adaptive_pool(out)  # (batch_size, 2048, encoded_image_size, encoded_image_size)
         out = out.permute(0, 2, 3, 1)  # (batch_size, encoded_image_size, encoded_image_size, 2048)
@@ -33,12 +33,18 @@ class SoftmaxDecoder(BaseDecoderWAttention):
 
 
 
-    def forward(self, encoder_out, encoded_captions, caption_lengths):
+    def forward(self, encoder_out, encoded_captions, caption_lengths, presorted=False, return_hidden=False, return_alphas=True):
         """
         Forward propagation.
         :param encoder_out: encoded images, a tensor of dimension (batch_size, enc_image_size, enc_image_size, encoder_dim)
         :param encoded_captions: encoded captions, a tensor of dimension (batch_size, max_caption_length)
         :param caption_lengths: caption lengths, a tensor of dimension (batch_size, 1)
+        :param presorted: the batch is already sorted by decreasing caption lengths (e.g. by the collate function)
+        :param return_hidden: return the inputs of the output layer (batch_size, max_decode_length, decoder_dim)
+            instead of the scores for vocabulary, so that the loss can be computed without storing all the scores
+        :param return_alphas: return the attention weights of every step (batch_size, max_decode_length, num_pixels),
+            otherwise only their sum over the decoded steps (batch_size, num_pixels) is kept, which is all the
+            doubly stochastic attention regularization needs
         :return: scores for vocabulary, sorted encoded captions, decode lengths, weights, sort indices
         """
 
@@ -51,9 +57,15 @@ class SoftmaxDecoder(BaseDecoderWAttention):
         num_pixels = encoder_out.size(1)
 
         # Sort input data by decreasing lengths; why? apparent below
-        caption_lengths, sort_ind = caption_lengths.sort(dim=0, descending=True)
-        encoder_out = encoder_out[sort_ind]
-        encoded_captions = encoded_captions[sort_ind]
+        if presorted:
+            sort_ind = torch.arange(batch_size, device=caption_lengths.device)
+        else:
+            caption_lengths, sort_ind = caption_lengths.sort(dim=0, descending=True)
+            encoder_out = encoder_out[sort_ind]
+            encoded_captions = encoded_captions[sort_ind]
+
+        # Project the encoded images into the attention space once for the whole caption
+        projected_encoder_out = self.attention.project_encoder(encoder_out)  # (batch_size, num_pixels, attention_dim)
 
         # Embedding
         embeddings = self.embedding(encoded_captions)  # (batch_size, max_caption_length, embed_dim)
@@ -67,32 +79,58 @@ class SoftmaxDecoder(BaseDecoderWAttention):
         decode_lengths = (caption_lengths - 1).tolist()
 
         # Create tensors to hold word predicion scores and alphas
-        predictions = torch.zeros(batch_size, max(decode_lengths), vocab_size).to(device)
-        alphas = torch.zeros(batch_size, max(decode_lengths), num_pixels).to(device)
+        predictions = torch.zeros(batch_size, max(decode_lengths), self.decoder_dim if return_hidden else vocab_size).to(device)
+        if return_alphas:
+            alphas = torch.zeros(batch_size, max(decode_lengths), num_pixels).to(device)
+        else:
+            alphas = torch.zeros(batch_size, num_pixels).to(device)
 
         input = self.sos_embedding.expand(batch_size, self.embed_dim).to(device)
 
+        # With teacher forcing the inputs of all the time-steps are known,
+        # so their part of the LSTM gates is computed once, outside of the loop
+        use_input_projection = self.use_input_projection()
+        if use_input_projection:
+            projected_inputs, recurrent_weight = self.project_inputs(
+                torch.cat([input.unsqueeze(1), embeddings[:, 1:max(decode_lengths)]], dim=1))  # (batch_size, max(decode_lengths), 4 * decoder_dim)
+            # Split by time-step, so that the backward pass stacks the step gradients once instead of once per step
+            projected_inputs = projected_inputs.unbind(1)
+
         # At each time-step, decode by
         # attention-weighing the encoder's output based on the decoder's previous hidden state output
         # then generate a new word in the decoder with the previous word and the attention weighted encoding
         for t in range(max(decode_lengths)):
             batch_size_t = sum([l > t for l in decode_lengths])
             attention_weighted_encoding, alpha = self.attention(encoder_out[:batch_size_t],
-                                                                h[:batch_size_t])
+                                                                h[:batch_size_t],
+                                                                projected_encoder_out[:batch_size_t])
             gate = self.sigmoid(self.f_beta(h[:batch_size_t]))  # gating scalar, (batch_size_t, encoder_dim)
             attention_weighted_encoding = gate * attention_weighted_encoding
-            h, c = self.decode_step(
-                torch.cat([input[:batch_size_t, :], attention_weighted_encoding], dim=1),
-                (h[:batch_size_t], c[:batch_size_t]))  # (batch_size_t, decoder_dim)
+            if use_input_projection:
+                h, c = self.projected_decode_step(projected_inputs[t][:batch_size_t], attention_weighted_encoding,
+                                                  (h[:batch_size_t], c[:batch_size_t]), recurrent_weight)  # (batch_size_t, decoder_dim)
+            else:
+                h, c = self.decode_step(
+                    torch.cat([input[:batch_size_t, :], attention_weighted_encoding], dim=1),
+                    (h[:batch_size_t], c[:batch_size_t]))  # (batch_size_t, decoder_dim)
 
-            preds = self.fc(self.dropout(h))  # (batch_size_t, vocab_size)
-            predictions[:batch_size_t, t, :] = preds
-            alphas[:batch_size_t, t, :] = alpha
+            if return_hidden:
+                hidden = self.dropout(h)  # (batch_size_t, decoder_dim)
+                predictions[:batch_size_t, t, :] = hidden
+            else:
+                preds = self.fc(self.dropout(h))  # (batch_size_t, vocab_size)
+                predictions[:batch_size_t, t, :] = preds
+            if return_alphas:
+                alphas[:batch_size_t, t, :] = alpha
+            else:
+                alphas[:batch_size_t] += alpha
 
             # When not using teacher forcing or with scheduled sampling prob
             # use the embedding for the previous generated word
             if self.use_tf_as_input == 0 or self.use_scheduled_sampling and random.random() < self.scheduled_sampling_prob:
                 #print("SS")
+                if return_hidden:
+                    preds = self.fc(hidden)
                 preds = F.log_softmax(preds, dim=1)
                 _, preds = torch.max(preds, dim=1)
                 input = self.embedding(preds)
@@ -11,6 +11,7 @@ import torchvision.transforms as transforms
 from nltk.translate.bleu_score import corpus_bleu
 import torch.nn.functional as F
 from tqdm import tqdm
+from beamSearch import beam_search
 
 from nlgeval import NLGEval
 
@@ -36,7 +37,7 @@ def main():
     encoder, decoder = setupEncoderDecoder(argParser, modelInfo)
 
     # Create data loaders
-    testLoader, _ = setupDataLoaders(argParser)
+    testLoader, _ = setupDataLoaders(argParser, encoder)
 
     # Load word <-> embeddings matrix index correspondence dictionaries
     idx2word, word2idx = loadWordIndexDicts(argParser)
@@ -57,17 +58,15 @@ def main():
       for metric in metrics_dict:
         file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
 
-def evaluate_beam(argParser, beam_size, encoder, decoder, testLoader, word2idx, idx2word):
+def evaluate_beam(argParser, beam_size, encoder, decoder, testLoader, word2idx, idx2word, detokenizer=None):
     """
     Evaluation
 
     :param beam_size: beam size at which to generate captions for evaluation
+    :param detokenizer: Detokenizer to reuse across evaluations, so that the references are only decoded once
     :return: BLEU-4 score
     """
 
-    # TODO: Batched Beam Search
-    # Therefore, do not use a batch_size greater than 1 - IMPORTANT!
-
     decoder.set_teacher_forcing_usage(DISABLE_TEACHER_FORCING)
     decoder.eval()
     encoder.eval()
@@ -76,152 +75,91 @@ def evaluate_beam(argParser, beam_size, encoder, decoder, testLoader, word2idx,
     # references = [[ref1a, ref1b, ref1c]], hypotheses = [hyp1, hyp2, ...]
     references = [[]]
     hypotheses = list()
-    vocab_size = decoder.embedding.weight.shape[0]
 
+    step_function = get_beam_step_function(argParser, decoder)
+
+    if detokenizer is None:
+        detokenizer = Detokenizer(idx2word, word2idx)
 
-    # For each image
+    # For each batch of images
     for i, (image, caps, caplens, studies) in enumerate(
             tqdm(testLoader, desc="EVALUATING AT BEAM SIZE " + str(beam_size))):
 
-        k = beam_size
-
-        #print(studies)
-
-        # Move to GPU device, if available
-        image = image.to(device)  # (1, 3, 256, 256)
-
-        # Encode
-        if (argParser.use_classifier_encoder):
-            encoder_out, _ = encoder(image)
-        else:
-            encoder_out = encoder(image)
-
-        #encoder_out = encoder(image)  # (1, enc_image_size, enc_image_size, encoder_dim)
-        enc_image_size = encoder_out.size(1)
-        encoder_dim = encoder_out.size(3)
-
-        # Flatten encoding
-        encoder_out = encoder_out.view(1, -1, encoder_dim)  # (1, num_pixels, encoder_dim)
-        num_pixels = encoder_out.size(1)
-
-        # We'll treat the problem as having a batch size of k
-        encoder_out = encoder_out.expand(k, num_pixels, encoder_dim)  # (k, num_pixels, encoder_dim)
-
-        # Tensor to store top k previous words at each step; now they're just <start>
-        k_prev_words = torch.LongTensor([[word2idx['<sos>']]] * k).to(device)  # (k, 1)
-
-        # Tensor to store top k sequences; now they're just <start>
-        seqs = k_prev_words  # (k, 1)
-        #print("Seqs1:",seqs.shape)
-
-        # Tensor to store top k sequences' scores; now they're just 0
-        top_k_scores = torch.zeros(k, 1).to(device)  # (k, 1)
+        with torch.no_grad():
+            # Move to GPU device, if available
+            image = image.to(device)  # (batch_size, 1, 256, 256)
 
-        # Lists to store completed sequences and scores
-        complete_seqs = list()
-        complete_seqs_scores = list()
+            # Encode
+            encoder_out = encodeImages(argParser, encoder, image)
 
-        # Start decoding
-        step = 1
-        h, c = decoder.init_hidden_state(encoder_out)
+            #encoder_out = encoder(image)  # (batch_size, enc_image_size, enc_image_size, encoder_dim)
+            batch_size = encoder_out.size(0)
+            encoder_dim = encoder_out.size(3)
 
-        # s is a number less than or equal to k, because sequences are removed from this process once they hit <end>
-        while True:
+            # Flatten encoding
+            encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
 
-            embeddings = decoder.embedding(k_prev_words).squeeze(1)  # (s, embed_dim)
+            h, c = decoder.init_hidden_state(encoder_out)  # (batch_size, decoder_dim)
 
-            awe, _ = decoder.attention(encoder_out, h)  # (s, encoder_dim), (s, num_pixels)
+            # Project the encoded images into the attention space once per image
+            projected_encoder_out = decoder.attention.project_encoder(encoder_out)
 
-            gate = decoder.sigmoid(decoder.f_beta(h))  # gating scalar, (s, encoder_dim)
-            awe = gate * awe
+            # We'll treat the problem as having a batch size of batch_size * k
+            encoder_out = encoder_out.repeat_interleave(beam_size, dim=0)  # (batch_size * k, num_pixels, encoder_dim)
+            projected_encoder_out = projected_encoder_out.repeat_interleave(beam_size, dim=0)
+            h = h.repeat_interleave(beam_size, dim=0)  # (batch_size * k, decoder_dim)
+            c = c.repeat_interleave(beam_size, dim=0)
 
-            h, c = decoder.decode_step(torch.cat([embeddings, awe], dim=1), (h, c))  # (s, decoder_dim)
+            seqs = beam_search(step_function, (h, c), (encoder_out, projected_encoder_out), batch_size, beam_size,
+                               word2idx['<sos>'], word2idx['<eoc>'], MAX_CAPTION_LENGTH)
 
-            if (argParser.model == "Softmax"):
-                scores = decoder.fc(h)  # (s, vocab_size)
-                scores = F.log_softmax(scores, dim=1)
+        references[0].extend(detokenizer.decodeReferences(studies, caps))
+        hypotheses.extend(detokenizer.decode(seqs, removeSpecialTokens=True))
 
-            elif (argParser.model == "Continuous"):
-                preds = decoder.fc(h) #(s, embed_dim)
-                preds = nn.functional.normalize(preds, p=2, dim=1)
-
-                # With normalized vectors dot product = cosine similarity
-                scores = torch.mm(preds, decoder.embedding.weight.T)  #(s,vocab_size)
+#        print("REFS: ", references)
+#        print("HIPS: ", hypotheses)
+        assert len(references[0]) == len(hypotheses)
 
+    return references, hypotheses
 
-            # Add
-            scores = top_k_scores.expand_as(scores) + scores  # (s, vocab_size)
 
-            # For the first step, all k points will have the same scores (since same k previous words, h, c)
-            if step == 1:
-                top_k_scores, top_k_words = scores[0].topk(k, 0, True, True)  # (s)
-            else:
-                # Unroll and find top scores, and their unrolled indices
-                top_k_scores, top_k_words = scores.view(-1).topk(k, 0, True, True)  # (s)
+def get_beam_step_function(argParser, decoder):
+    """
+    Creates the function which performs one decoding step of the beam search for the Softmax and Continuous decoders
 
-            # Convert unrolled indices to actual indices of scores
-            prev_word_inds = top_k_words / vocab_size  # (s)
-            next_word_inds = top_k_words % vocab_size  # (s)
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param decoder: Decoder to generate reports
+    :return: step function to be used by beam_search
+    """
 
-            # Add new words to sequences
-            seqs = torch.cat([seqs[prev_word_inds], next_word_inds.unsqueeze(1)], dim=1)  # (s, step+1)
+    # Normalized embeddings, built once for the whole search
+    if (argParser.model == "Continuous"):
+        nearest_words = NearestWordIndex(decoder.embedding.weight, argParser.nearest_word_precision)
 
-            # Which sequences are incomplete (didn't reach <eoc>)?
-            incomplete_inds = [ind for ind, next_word in enumerate(next_word_inds) if
-                               next_word != word2idx['<eoc>']]
-            complete_inds = list(set(range(len(next_word_inds))) - set(incomplete_inds))
+    def step_function(k_prev_words, state, context, step):
+        h, c = state
+        encoder_out, projected_encoder_out = context
 
-            # Set aside complete sequences
-            if len(complete_inds) > 0:
-                complete_seqs.extend(seqs[complete_inds].tolist())
-                complete_seqs_scores.extend(top_k_scores[complete_inds])
-            k -= len(complete_inds)  # reduce beam length accordingly
+        embeddings = decoder.embedding(k_prev_words)  # (s, embed_dim)
 
-            # Proceed with incomplete sequences
-            if k == 0:
-                break
-            seqs = seqs[incomplete_inds]
-            h = h[prev_word_inds[incomplete_inds]]
-            c = c[prev_word_inds[incomplete_inds]]
-            encoder_out = encoder_out[prev_word_inds[incomplete_inds]]
-            top_k_scores = top_k_scores[incomplete_inds].unsqueeze(1)
-            k_prev_words = next_word_inds[incomplete_inds].unsqueeze(1)
+        awe, _ = decoder.attention(encoder_out, h, projected_encoder_out)  # (s, encoder_dim), (s, num_pixels)
 
-            # Break if things have been going on too long
-            if step > MAX_CAPTION_LENGTH:
-                break
-            step += 1
-
-        # If MAX CAPTION LENGTH has been reached and no sequence has reached the eoc
-        # there will be no complete seqs, use the incomplete ones
-        if k == beam_size:
-            complete_seqs.extend(seqs[[incomplete_inds]].tolist())
-            complete_seqs_scores.extend(top_k_scores[[incomplete_inds]])
+        gate = decoder.sigmoid(decoder.f_beta(h))  # gating scalar, (s, encoder_dim)
+        awe = gate * awe
 
-        # Choose best sequence overall
-        i = complete_seqs_scores.index(max(complete_seqs_scores))
-        seq = complete_seqs[i]
+        h, c = decoder.decode_step(torch.cat([embeddings, awe], dim=1), (h, c))  # (s, decoder_dim)
 
-        # References
-        ref = [w for w in caps[0].tolist() if w not in {word2idx['<sos>'], word2idx['<eoc>'], word2idx['<pad>']}]
-        references[0].append(decodeCaption(ref, idx2word))
+        if (argParser.model == "Softmax"):
+            scores = decoder.fc(h)  # (s, vocab_size)
+            scores = F.log_softmax(scores, dim=1)
 
-        # Hypotheses
-        seq = [w for w in seq if w not in {word2idx['<sos>'], word2idx['<eoc>'], word2idx['<pad>']}]
-        hypotheses.append(decodeCaption(seq, idx2word))
+        elif (argParser.model == "Continuous"):
+            preds = decoder.fc(h) #(s, embed_dim)
+            scores = nearest_words.scores(preds)  #(s,vocab_size), cosine similarity
 
-#        print("Current",studies[0])
-#        print("obj",obj_study)
-#        if (studies[0] == obj_study):
-#            print("Refs:", decodeCaption(ref, idx2word))
-#            print("HIPS: ", decodeCaption(seq, idx2word))
-#            break
-#        print("REFS: ", references)
-#        print("HIPS: ", hypotheses)
-        assert len(references[0]) == len(hypotheses)
-#        break
+        return scores, (h, c)
 
-    return references, hypotheses
+    return step_function
 
 
 if __name__ == '__main__':
@@ -18,18 +18,13 @@ from nlgeval import NLGEval
 
 MAX_CAPTION_LENGTH = 350
 DISABLE_TEACHER_FORCING = 0
+COMPACTION_INTERVAL = 8
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # sets device for model and PyTorch tensors
 
 
-# NOTE: This code can be easily changed to support batched operations
-# however the program allocates insurmountable amounts of memory during the for/while
-# cycle during the decoding process in the decode_step line. The program is unable to handle smaller batches
-# when compared to the training phase, even though during testing the gradients are not kept...
-
-# After some time looking into this we decided to just
-# tank the extended validation time for unbatched operations but if a solution arises
-# we would look forward to hear it. In any case the needed code to change to batched operations is left commented
+# Decoding runs batched without gradients. Sequences that produced <eoc> are masked as finished
+# and dropped from the batch every COMPACTION_INTERVAL steps
 
 
 def main():
@@ -44,7 +39,7 @@ def main():
     encoder, decoder = setupEncoderDecoder(argParser, modelInfo)
 
     # Create data loaders
-    testLoader, _ = setupDataLoaders(argParser)
+    testLoader, _ = setupDataLoaders(argParser, encoder)
 
     # Load word <-> embeddings matrix index correspondence dictionaries
     idx2word, word2idx = loadWordIndexDicts(argParser)
@@ -64,7 +59,7 @@ def main():
       for metric in metrics_dict:
         file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
 
-def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word):
+def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word, detokenizer=None):
     """
     Greedy Evaluation
 
@@ -74,6 +69,7 @@ def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word)
     :param testLoader: data loader with test data
     :param word2idx: hash table with word -> index correspondence
     :param idx2word: hash table with index -> word correspondence
+    :param detokenizer: Detokenizer to reuse across evaluations, so that the references are only decoded once
     :return: hypothesis and references
     """
     decoder.set_teacher_forcing_usage(DISABLE_TEACHER_FORCING)
@@ -84,116 +80,89 @@ def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word)
     # references = [[ref1a, ref1b, ref1c]], hypotheses = [hyp1, hyp2, ...]
     references = [[]]
     hypotheses = list()
-    vocab_size = decoder.embedding.weight.shape[0]
 
-    smoothL1Calculator = nn.SmoothL1Loss(reduction='none')
+    if detokenizer is None:
+        detokenizer = Detokenizer(idx2word, word2idx)
+
+    # Normalized embeddings, built once for the whole evaluation
+    if (argParser.model == "Continuous"):
+        nearest_words = NearestWordIndex(decoder.embedding.weight, argParser.nearest_word_precision)
 
-    # For each image
+    # For each batch of images
     for i, (image, caps, caplens, studies) in enumerate(
             tqdm(testLoader, desc="Evaluating with greedy decoding: ")):
 
-        t = 0
-
-        #finished_sequences = []      NEEDED FOR BATCHED OPERATIONS (BO)
-        nr_ended_sequences = 0     #REMOVE IF USING BO
-
-        # Move to GPU device, if available
-        image = image.to(device)  # (batch_size, 3, 224, 224)
-
-        # Encode
-        if (argParser.use_classifier_encoder):
-            encoder_out, _ = encoder(image)
-        else:
-            encoder_out = encoder(image)
-        #encoder_out = encoder(image)  # (batch_size, enc_image_size, enc_image_size, encoder_dim)
-
-        enc_image_size = encoder_out.size(1)
-        encoder_dim = encoder_out.size(3)
-        batch_size = encoder_out.size(0)
-
-        # Flatten encoding
-        encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
-        num_pixels = encoder_out.size(1)
-
-        h, c = decoder.init_hidden_state(encoder_out)  # (batch_size, decoder_dim)
-
-
-        input = decoder.sos_embedding.expand(batch_size, decoder.embed_dim).to(device) # (batch_size, embed_dim)
-
-        predictions = torch.zeros(batch_size, MAX_CAPTION_LENGTH, 1, dtype=torch.long).to(device)
-        alphas = torch.zeros(batch_size, MAX_CAPTION_LENGTH , num_pixels).to(device)
-
-
-
-        #while batch_size > len(finished_sequences)   NEEDED FOR BO
-        while batch_size > nr_ended_sequences:   # REMOVE IF USING BO
+        with torch.no_grad():
+            # Move to GPU device, if available
+            image = image.to(device)  # (batch_size, 1, 224, 224)
 
-            awe, alpha = decoder.attention(encoder_out, h)
+            # Encode
+            encoder_out = encodeImages(argParser, encoder, image)
+            #encoder_out = encoder(image)  # (batch_size, enc_image_size, enc_image_size, encoder_dim)
 
-            gate = decoder.sigmoid(decoder.f_beta(h))  # gating scalar, (batch_size, encoder_dim)
-            awe = gate * awe
+            encoder_dim = encoder_out.size(3)
+            batch_size = encoder_out.size(0)
 
-            h, c = decoder.decode_step(torch.cat([input, awe], dim=1), (h, c))  # (batch_size, decoder_dim)
+            # Flatten encoding
+            encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
 
-            if (argParser.model == "Softmax"):
-                scores = decoder.fc(h)  # (batch_size, vocab_size)
-                scores = F.log_softmax(scores, dim=1)   # (batch_size, vocab_size)
-                pred_word_indexes = torch.argmax(scores, dim=1)   # (batch_size, 1)
+            h, c = decoder.init_hidden_state(encoder_out)  # (batch_size, decoder_dim)
 
-                # Since we keep decoding even after producing an eoc, this only works if using a single instance
-                # During batched operations sequences that have already produced eoc can (and most likely will)
-                # produce <eoc>s again
-                nr_ended_sequences += pred_word_indexes.tolist().count(word2idx['<eoc>'])  #REMOVE IF USING BO
+            # Project the encoded images into the attention space once per image
+            projected_encoder_out = decoder.attention.project_encoder(encoder_out)  # (batch_size, num_pixels, attention_dim)
 
+            input = decoder.sos_embedding.expand(batch_size, decoder.embed_dim).to(device) # (batch_size, embed_dim)
 
-                #NEEDED FOR BO
-                #sentences_that_produced_eoc = [i for i, e in enumerate(pred_word_indexes.tolist()) if e == word2idx['<eoc>']]
-                #finished_sequences.extend([i for i in sentences_that_produced_eoc if i not in finished_sequences])
+            # Positions after the end of a sequence hold <eoc>, so its caption is cut there even when <eoc> is its first word
+            predictions = torch.full((batch_size, MAX_CAPTION_LENGTH), word2idx['<eoc>'], dtype=torch.long, device=device)
 
+            # Batch position of the sequences still being decoded and which of them already produced <eoc>
+            active_ids = torch.arange(batch_size, device=device)
+            finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
 
-            elif (argParser.model == "Continuous"):
-                preds = decoder.fc(h) # (batch_size, embed_dim)
-                preds =  torch.nn.functional.normalize(preds, p=2, dim=1)
+            for t in range(MAX_CAPTION_LENGTH):
 
-                # With normalized vectors  dot product = cosine similarity 
-                cosine_sim_scores = torch.mm(preds, decoder.embedding.weight.T)  #(batch_size, vocab_size)
-                
-                #print(decoder.embedding.weight.shape)
-                #cosine_sim_scores = getSmoothL1Distance(preds, decoder.embedding.weight, smoothL1Calculator) #cosine_sim_scores = getSmoothL1Distance(preds, target)
-                #cosine_sim_scores.unsqueeze_(0)
-                pred_word_indexes = torch.argmax(cosine_sim_scores, dim=1)  #(batch_size, 
+                awe, _ = decoder.attention(encoder_out, h, projected_encoder_out)
 
-                # See softmax model comments
-                nr_ended_sequences += pred_word_indexes.tolist().count(word2idx['<eoc>'])  # REMOVE IF USING BO
+                gate = decoder.sigmoid(decoder.f_beta(h))  # gating scalar, (active, encoder_dim)
+                awe = gate * awe
 
-                # NEEDED FOR BO
-                # sentences_that_produced_eoc = [i for i, e in enumerate(pred_word_indexes.tolist()) if e == word2idx['<eoc>']]
-                # finished_sequences.extend([i for i in sentences_that_produced_eoc if i not in finished_sequences])
+                h, c = decoder.decode_step(torch.cat([input, awe], dim=1), (h, c))  # (active, decoder_dim)
 
+                if (argParser.model == "Softmax"):
+                    scores = decoder.fc(h)  # (active, vocab_size)
+                    pred_word_indexes = torch.argmax(scores, dim=1)   # (active)
 
-            predictions[:, t, :] = pred_word_indexes
-            alphas[:, t, :] = alpha
+                elif (argParser.model == "Continuous"):
+                    preds = decoder.fc(h) # (active, embed_dim)
+                    pred_word_indexes = nearest_words.nearest(preds)  #(active)
 
-            input = decoder.embedding(pred_word_indexes)
-            t +=1
-      
-            if t > MAX_CAPTION_LENGTH - 1:
-                #print("Reached maximum caption length, ending batch")
-                break
+                # Sequences which already produced <eoc> are padded with <eoc> in the remaining positions
+                predictions[active_ids, t] = pred_word_indexes.masked_fill(finished, word2idx['<eoc>'])
+                finished = finished | (pred_word_indexes == word2idx['<eoc>'])
 
+                input = decoder.embedding(pred_word_indexes)
 
-        # The decodeCaption function stops after the first <eoc>, but does not handle pads or sos
-        for reference in caps:
-            encoded_reference = [w for w in reference.tolist() if w not in {word2idx['<sos>'], word2idx['<eoc>'], word2idx['<pad>']}]
-            references[0].append(decodeCaption(encoded_reference, idx2word))
+                # Finished sequences are only dropped every COMPACTION_INTERVAL steps,
+                # keeping host syncs out of the other steps
+                if (t + 1) % COMPACTION_INTERVAL == 0:
+                    keep = (~finished).nonzero().squeeze(1)
+                    if keep.size(0) == 0:
+                        break
+                    if keep.size(0) < finished.size(0):
+                        active_ids = active_ids[keep]
+                        finished = finished[keep]
+                        encoder_out = encoder_out[keep]
+                        projected_encoder_out = projected_encoder_out[keep]
+                        h = h[keep]
+                        c = c[keep]
+                        input = input[keep]
 
-        for hyp in predictions:
-            hypotheses.append(decodeCaption(hyp.squeeze(1).tolist(), idx2word))
+        references[0].extend(detokenizer.decodeReferences(studies, caps))
+        # The predictions are cut at their first <eoc>
+        hypotheses.extend(detokenizer.decode(predictions))
 
-        #print("REFS: ", references)
-        #print("HIPS: ", hypotheses)
         assert len(references[0]) == len(hypotheses)
-        #break
 
 
     return references, hypotheses
@@ -0,0 +1,174 @@
+import sys
+sys.path.append('../Utils/')
+sys.path.append('../')
+
+from setupEnvironment import *
+from argParser import *
+import torch.backends.cudnn as cudnn
+import torch.optim
+import torch.utils.data
+import torchvision.transforms as transforms
+import torch.nn.functional as F
+from tqdm import tqdm
+from beamSearch import beam_search
+
+from nlgeval import NLGEval
+
+BEAM_SIZE = 4
+MAX_SENTENCE_LENGTH = 64
+MAX_REPORT_LENGTH = 9
+DISABLE_TEACHER_FORCING = 0
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # sets device for model and PyTorch tensors
+
+
+def main():
+    argParser = get_args()
+
+    print(argParser)
+
+    if (argParser.checkpoint is not None):
+        modelInfo = torch.load(argParser.checkpoint)
+
+    # Load model
+    encoder, decoder = setupEncoderDecoder(argParser, modelInfo)
+
+    # Create data loaders
+    testLoader, _ = setupDataLoaders(argParser, encoder)
+
+    # Load word <-> embeddings matrix index correspondence dictionaries
+    idx2word, word2idx = loadWordIndexDicts(argParser)
+
+    # Create NlG metrics evaluator
+    nlgeval = NLGEval(metrics_to_omit=['SkipThoughtCS', 'GreedyMatchingScore', 'VectorExtremaCosineSimilarity', 'EmbeddingAverageCosineSimilarity'])
+
+    references, hypotheses = hierarchical_evaluate_beam(argParser, BEAM_SIZE, encoder, decoder, testLoader, word2idx, idx2word)
+
+    metrics_dict = nlgeval.compute_metrics(references, hypotheses)
+
+    print(metrics_dict)
+
+    refs_path, preds_path = save_references_and_predictions(references, hypotheses, argParser.model_name, "Beam")
+
+    with open('../Experiments/' + argParser.model_name + "/BeamTestResults.txt", "w+") as file:
+      for metric in metrics_dict:
+        file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
+
+
+def hierarchical_evaluate_beam(argParser, beam_size, encoder, decoder, testLoader, word2idx, idx2word, detokenizer=None):
+    """
+    Beam search evaluation of the hierarchical models. The sentence LSTM runs once per batch of reports, then
+    the words of all the generated sentences are searched as a single batch, with beam_size beams per sentence.
+
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param beam_size: beam size at which to generate the sentences
+    :param encoder: Image Encoder used
+    :param decoder: Decoder to generate reports
+    :param testLoader: data loader with test data
+    :param word2idx: hash table with word -> index correspondence
+    :param idx2word: hash table with index -> word correspondence
+    :param detokenizer: Detokenizer to reuse across evaluations, so that the references are only decoded once
+    :return: hypothesis and references
+    """
+    decoder.set_teacher_forcing_usage(DISABLE_TEACHER_FORCING)
+    decoder.eval()
+    encoder.eval()
+
+    # Lists to store references (true captions), and hypothesis (prediction) for each image
+    # references = [[ref1a, ref1b, ref1c]], hypotheses = [hyp1, hyp2, ...]
+    references = [[]]
+    hypotheses = list()
+
+    step_function = get_hierarchical_beam_step_function(argParser, decoder)
+
+    if detokenizer is None:
+        detokenizer = Detokenizer(idx2word, word2idx)
+
+    # For each batch of images
+    for i, (image, caps, caplens, studies) in enumerate(
+            tqdm(testLoader, desc="EVALUATING HIERARCHICAL MODEL AT BEAM SIZE " + str(beam_size))):
+
+        with torch.no_grad():
+            # Move to GPU device, if available
+            image = image.to(device)  # (batch_size, 1, 256, 256)
+
+            # Encode
+            encoder_out = encodeImages(argParser, encoder, image)
+
+            batch_size = encoder_out.size(0)
+            encoder_dim = encoder_out.size(3)
+
+            # Flatten encoding
+            encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
+
+            # Topic vectors of the sentences of each report, the visual attention keys are projected once per report
+            topic_vectors, generated = decoder.generate_topics(encoder_out, MAX_REPORT_LENGTH)
+
+            sentence_ids = generated.nonzero()  # (nr_sentences, 2), (report, sentence) ordered by report then sentence
+            topic_vectors = topic_vectors[sentence_ids[:, 0], sentence_ids[:, 1]]  # (nr_sentences, embed_dim)
+            nr_sentences = topic_vectors.size(0)
+
+            seqs = []
+            if nr_sentences > 0:
+                # We'll treat the problem as having a batch size of nr_sentences * k
+                topic_vectors = topic_vectors.repeat_interleave(beam_size, dim=0)  # (nr_sentences * k, embed_dim)
+                h_word, c_word = decoder.init_word_hidden_state(nr_sentences * beam_size)
+
+                # A sentence ends with a '.' after its first two words, as in greedy decoding
+                seqs = beam_search(step_function, (h_word, c_word), (topic_vectors,), nr_sentences, beam_size,
+                                   word2idx['<sos>'], word2idx['.'], MAX_SENTENCE_LENGTH - 1, min_end_step=3)
+
+        report_sentences = [[] for _ in range(batch_size)]
+        for (report, _), seq in zip(sentence_ids.tolist(), seqs):
+            # The first word of the sequences is the start index, which stands for the topic vector
+            report_sentences[report].extend(seq[1:])
+
+        references[0].extend(detokenizer.decodeReferences(studies, caps))
+        hypotheses.extend(detokenizer.decode(report_sentences))
+
+        assert len(references[0]) == len(hypotheses)
+
+    return references, hypotheses
+
+
+def get_hierarchical_beam_step_function(argParser, decoder):
+    """
+    Creates the function which performs one step of the word LSTM in the beam search for the
+    HierarchicalSoftmax and HierarchicalContinuous decoders
+
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param decoder: Decoder to generate reports
+    :return: step function to be used by beam_search
+    """
+
+    # Normalized embeddings, built once for the whole search
+    if (argParser.model == "HierarchicalContinuous"):
+        nearest_words = NearestWordIndex(decoder.embedding.weight, argParser.nearest_word_precision)
+
+    def step_function(k_prev_words, state, context, step):
+        h_word, c_word = state
+        topic_vectors, = context
+
+        # The topic vector is the input of the first step
+        if step == 1:
+            word_lstm_input = topic_vectors
+        else:
+            word_lstm_input = decoder.embedding(k_prev_words)  # (s, embed_dim)
+
+        h_word, c_word = decoder.word_decoder(torch.cat([topic_vectors, word_lstm_input], dim=1), (h_word, c_word))  # (s, hidden_dim)
+
+        if (argParser.model == "HierarchicalSoftmax"):
+            scores = decoder.fc(h_word)  # (s, vocab_size)
+            scores = F.log_softmax(scores, dim=1)
+
+        elif (argParser.model == "HierarchicalContinuous"):
+            preds = decoder.fc(h_word) #(s, embed_dim)
+            scores = nearest_words.scores(preds)  #(s,vocab_size), cosine similarity
+
+        return scores, (h_word, c_word)
+
+    return step_function
+
+
+if __name__ == '__main__':
+    main()
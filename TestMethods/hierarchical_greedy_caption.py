@@ -19,6 +19,7 @@ from nlgeval import NLGEval
 MAX_SENTENCE_LENGTH = 64
 MAX_REPORT_LENGTH = 9
 DISABLE_TEACHER_FORCING = 0
+COMPACTION_INTERVAL = 8
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # sets device for model and PyTorch tensors
 
 
@@ -34,7 +35,7 @@ def main():
     encoder, decoder = setupEncoderDecoder(argParser, modelInfo)
 
     # Create data loaders
-    testLoader, _ = setupDataLoaders(argParser)
+    testLoader, _ = setupDataLoaders(argParser, encoder)
 
     # Load word <-> embeddings matrix index correspondence dictionaries
     idx2word, word2idx = loadWordIndexDicts(argParser)
@@ -58,7 +59,7 @@ def main():
 
 
 
-def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word):
+def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word, detokenizer=None):
     """
     Greedy Evaluation
 
@@ -68,6 +69,7 @@ def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word)
     :param testLoader: data loader with test data
     :param word2idx: hash table with word -> index correspondence
     :param idx2word: hash table with index -> word correspondence
+    :param detokenizer: Detokenizer to reuse across evaluations, so that the references are only decoded once
     :return: hypothesis and references
     """
     decoder.set_teacher_forcing_usage(DISABLE_TEACHER_FORCING)
@@ -78,150 +80,111 @@ def evaluate_greedy(argParser, encoder, decoder, testLoader, word2idx, idx2word)
     # references = [[ref1a, ref1b, ref1c]], hypotheses = [hyp1, hyp2, ...]
     references = [[]]
     hypotheses = list()
-    vocab_size = decoder.embedding.weight.shape[0]
 
+    if detokenizer is None:
+        detokenizer = Detokenizer(idx2word, word2idx)
 
-    # For each image
-    for i, (image, caps, caplens,_) in enumerate(
+    # For each batch of images
+    for i, (image, caps, caplens, studies) in enumerate(
             tqdm(testLoader, desc="Evaluating hierarchical model with greedy decoding: ")):
 
-        caps = caps.to(device)
+        with torch.no_grad():
+            # Move to GPU device, if available
+            image = image.to(device)  # (batch_size, 1, 224, 224)
 
-        # Move to GPU device, if available
-        image = image.to(device)  # (batch_size, 3, 224, 224)
+            # Encode
+            encoder_out = encodeImages(argParser, encoder, image)
 
-        # Encode
-        encoder_out, pred_logits = encoder(image)
-        enc_image_size = encoder_out.size(1)
-        encoder_dim = encoder_out.size(3)
-        batch_size = encoder_out.shape[0]
+            encoder_dim = encoder_out.size(3)
+            batch_size = encoder_out.size(0)
 
-        label_probs = torch.sigmoid(pred_logits)
+            # Flatten encoding
+            encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
 
-        # Flatten encoding
-        encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
-        num_pixels = encoder_out.size(1)
+            report_sentences = greedy_decode_reports(argParser, decoder, encoder_out, word2idx)
 
-        resized_img = decoder.resize_encoder_features(encoder_out.mean(dim=1))
+        references[0].extend(detokenizer.decodeReferences(studies, caps))
+        hypotheses.extend(detokenizer.decode([[w for sentence in sentences for w in sentence] for sentences in report_sentences]))
 
-        t_s = 0
-
-        sentence = []
-        h_sent, c_sent = decoder.init_sent_hidden_state(batch_size)
-
-        words = 0
-
-        #word_lstm_input = decoder.sos_embedding.expand(batch_size, decoder.embed_dim).to(device)
-
-        topic_vector = 0
-
-        while t_s < MAX_REPORT_LENGTH:
-
-             attention_weighted_visual_encoding, visual_alpha = decoder.visual_attention(encoder_out, h_sent)
-
-             #attention_weighted_label_encoding, label_alpha = decoder.label_attention(label_probs, h_sent)
-
-             #context_vector = decoder.context_vector_fc(torch.cat([attention_weighted_visual_encoding, attention_weighted_label_encoding]
-             #                 ,dim= 1))
-
-             context_vector = decoder.context_vector_fc(attention_weighted_visual_encoding)
-
-             #print(context_vector)
-             #print(h_sent)
-
-             prev_h_sent = h_sent
-
-             h_sent, c_sent = decoder.sentence_decoder(context_vector, (h_sent, c_sent))
-
-             topic_vector = decoder.topic_vector(decoder.tanh(decoder.context_vector_W_h_t(h_sent) + decoder.context_vector_W(context_vector)))
-
-             #print(topic_vector)
-
-
-             stop_prob = decoder.stop(decoder.tanh(decoder.stop_h_1(prev_h_sent) + decoder.stop_h(h_sent)))
-
-             #topic_vector, stop_prob = decoder.sentence_decoder_fc(h_sent).split(decoder.sentence_decoder_fc_sizes, 1)
-
-             #print(topic_vector)
-
-             #print("stop prob:", torch.sigmoid(stop_prob))
-
-             if (torch.sigmoid(stop_prob) > 0.5):
-                 break
-
-             #predictions = torch.zeros(unfinished_reports, MAX, vocab_size).to(device)
-             h_word, c_word = decoder.init_word_hidden_state(batch_size)
-             #h_word, c_word = decoder.word_decoder(topic_vector, (h_word, c_word))
-             #word_lstm_input = topic_vector
-             #word_lstm_input = decoder.sos_embedding.expand(batch_size, decoder.embed_dim).to(device)
-             word_lstm_input = topic_vector
-
-             t_w = 0
-
-             print("New sentence")
-             while t_w < MAX_SENTENCE_LENGTH: 
-
-                 print(word_lstm_input)
+        assert len(references[0]) == len(hypotheses)
 
-                 #print(h_word)
-                 #print(word_lstm_input)
-                 h_word, c_word = decoder.word_decoder(torch.cat([topic_vector, word_lstm_input],1), (h_word, c_word))
 
-                 if (argParser.model == "HierarchicalSoftmax"):
-                     
-                     scores = decoder.fc(h_word)  # (batch_size, vocab_size)
-                     #print("scores:", scores)
-                     scores = F.log_softmax(scores, dim=1)   # (batch_size, vocab_size)
-                     #print("softmaxed", scores)
-                     pred_word_indexes = torch.argmax(scores, dim=1)
+    return references, hypotheses
 
 
-                 elif (argParser.model == "HierarchicalContinuous"):
-                     preds = decoder.fc(h_word) # (batch_size, embed_dim)
-                     preds =  torch.nn.functional.normalize(preds, p=2, dim=1)
+def greedy_decode_reports(argParser, decoder, encoder_out, word2idx):
+    """
+    Batched greedy decoding of reports. The sentence LSTM runs first for the whole batch, then the words of
+    all the generated sentences, of all the reports, are decoded as a single batch.
 
-                     cosine_sim_scores = torch.mm(preds, decoder.embedding.weight.T)  #(batch_size, vocab_size)
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param decoder: Decoder to generate reports
+    :param encoder_out: encoded images, a tensor of dimension (batch_size, num_pixels, encoder_dim)
+    :param word2idx: hash table with word -> index correspondence
+    :return: for each report, the list of its sentences, each a list of word indexes
+    """
+    batch_size = encoder_out.size(0)
 
-                     pred_word_indexes = torch.argmax(cosine_sim_scores, dim=1)  #(ba
+    if (argParser.model == "HierarchicalContinuous"):
+        nearest_words = NearestWordIndex(decoder.embedding.weight, argParser.nearest_word_precision)
 
+    # Per report stop mask: the sentences generated before the first stop
+    topic_vectors, generated = decoder.generate_topics(encoder_out, MAX_REPORT_LENGTH)
 
+    sentence_ids = generated.nonzero()  # (nr_sentences, 2), (report, sentence) ordered by report then sentence
+    topic_vectors = topic_vectors[sentence_ids[:, 0], sentence_ids[:, 1]]  # (nr_sentences, embed_dim)
+    nr_sentences = topic_vectors.size(0)
 
-                 sentence.append(pred_word_indexes.item())
-                 #print(sentence)
+    # Words of each sentence, -1 after its end
+    predictions = torch.full((nr_sentences, MAX_SENTENCE_LENGTH), -1, dtype=torch.long).to(device)
 
-                 if (t_w > 1 and pred_word_indexes.item() == word2idx['.']):
-                     break
- 
-                 t_w += 1
-                 #if (t_w > 2):
-                 word_lstm_input = decoder.embedding(pred_word_indexes)
-                 #else:
-                 #word_lstm_input = decoder.embedding(caps[:,words]).to(device)
-                 words += 1
-                 #print(caps[:,words])
+    if nr_sentences > 0:
+        h_word, c_word = decoder.init_word_hidden_state(nr_sentences)
+        word_lstm_input = topic_vectors
 
-             t_s +=1
+        # Position of the sentences still being decoded and which of them already ended
+        active_ids = torch.arange(nr_sentences, device=device)
+        ended = torch.zeros(nr_sentences, dtype=torch.bool, device=device)
 
+        for t_w in range(MAX_SENTENCE_LENGTH):
 
-        #print(caps)
+            h_word, c_word = decoder.word_decoder(torch.cat([topic_vectors, word_lstm_input], 1), (h_word, c_word))
 
-        #print(sentence)
-        hypotheses.append(decodeCaption(sentence, idx2word))
+            if (argParser.model == "HierarchicalSoftmax"):
+                scores = decoder.fc(h_word)  # (active, vocab_size)
+                pred_word_indexes = torch.argmax(scores, dim=1)  # (active)
 
-        for reference in caps:
-            #print("Caps", caps)
-            encoded_reference = [w for w in reference.tolist() if w not in {word2idx['<sos>'], word2idx['<eoc>'], word2idx['<pad>']}]
-            references[0].append(decodeCaption(encoded_reference, idx2word))
-        print("REFS:", references[0])
-        print("HIPS" ,hypotheses)
-        assert len(references[0]) == len(hypotheses)
+            elif (argParser.model == "HierarchicalContinuous"):
+                preds = decoder.fc(h_word) # (active, embed_dim)
+                pred_word_indexes = nearest_words.nearest(preds)  #(active)
 
+            # Per sentence end mask: a sentence ends with a '.' after its first two words
+            predictions[active_ids, t_w] = pred_word_indexes.masked_fill(ended, -1)
+            if t_w > 1:
+                ended = ended | (pred_word_indexes == word2idx['.'])
 
-        break
+            word_lstm_input = decoder.embedding(pred_word_indexes)
 
+            # Ended sentences are only dropped every COMPACTION_INTERVAL steps,
+            # keeping host syncs out of the other steps
+            if (t_w + 1) % COMPACTION_INTERVAL == 0:
+                keep = (~ended).nonzero().squeeze(1)
+                if keep.size(0) == 0:
+                    break
+                if keep.size(0) < ended.size(0):
+                    active_ids = active_ids[keep]
+                    ended = ended[keep]
+                    topic_vectors = topic_vectors[keep]
+                    h_word = h_word[keep]
+                    c_word = c_word[keep]
+                    word_lstm_input = word_lstm_input[keep]
 
+    # Single transfer of the decoded words to the host
+    report_sentences = [[] for _ in range(batch_size)]
+    for (report, _), sentence in zip(sentence_ids.tolist(), predictions.tolist()):
+        report_sentences[report].append([w for w in sentence if w != -1])
 
-    return references, hypotheses
+    return report_sentences
 
 
 if __name__ == '__main__':
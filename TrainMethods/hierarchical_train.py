@@ -0,0 +1,319 @@
+import sys
+sys.path.append('../Utils/')
+sys.path.append('../')
+sys.path.append('../TestMethods/')
+
+from setupEnvironment import *
+from argParser import *
+from hierarchical_greedy_caption import *
+from hierarchical_beam_caption import *
+import torch.backends.cudnn as cudnn
+import torch.optim
+import torch.utils.data
+import torchvision.transforms as transforms
+import torch.nn.functional as F
+from tqdm import tqdm
+
+from hierarchicalSentences import *
+from nlgMetrics import *
+import numpy
+import random
+import time
+
+
+BEAM_SIZE = 4
+MAX_CAPTION_LENGTH = 350
+MAX_SENTENCE_LENGTH = 64
+MAX_REPORT_LENGTH = 9
+DISABLE_TEACHER_FORCING = 0
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # sets device for model and PyTorch tensors
+
+
+# Normalizations of the loss of a batch, given the loss and the length in sentences of its reports
+LOSS_NORMALIZATIONS = {
+    'Sum': lambda loss, report_lengths: loss,
+    'MaxReportLength': lambda loss, report_lengths: loss / report_lengths.max(),
+}
+
+
+
+def main():
+    argParser = get_args()
+
+    print(argParser)
+
+    modelInfo = None
+    classifierInfo = None
+
+    if (argParser.checkpoint is not None):
+        modelInfo = torch.load(argParser.checkpoint)
+
+    if (argParser.use_classifier_encoder) and modelInfo is None:
+        classifierInfo = torch.load(argParser.classifier_checkpoint)
+
+    if not os.path.isdir('../Experiments/' + argParser.model_name):
+        os.mkdir('../Experiments/' + argParser.model_name)
+
+    trainingEnvironment = TrainingEnvironment(argParser)
+
+    cudnn.benchmark = True
+
+
+    encoder, decoder = setupEncoderDecoder(argParser, modelInfo, classifierInfo)
+
+    encoder_optimizer, decoder_optimizer = setupOptimizers(encoder, decoder, argParser, modelInfo)
+
+    decoder_scheduler, encoder_scheduler = setupSchedulers(encoder_optimizer, decoder_optimizer, argParser)
+
+    # Per word losses, which train weighs by sentence and by report
+    criterion = setupCriterion(argParser.loss, argParser, reduction='none')
+
+    binary_criterion = nn.BCEWithLogitsLoss(reduction='none')
+
+    trainLoader, valLoader = setupDataLoaders(argParser, encoder)
+
+    # Load word <-> embeddings matrix index correspondence dictionaries
+    idx2word, word2idx = loadWordIndexDicts(argParser)
+
+    # Decodes the validation references once, on the first validation
+    detokenizer = Detokenizer(idx2word, word2idx)
+
+    # Sentence split train reports, read on the first batch when the train loader does not read them from the sentence store
+    trainSentences = HierarchicalSentences(argParser.trainSentencesPath, argParser.trainSentencesLengthsPath,
+                                           argParser.trainReportLengthInSentencesPath, word2idx['<pad>'])
+
+    # Validation metrics, the reference statistics are computed on the first validation
+    nlgMetrics = NLGMetrics(argParser.nlg_metrics_workers)
+
+    scheduled_sampling_prob = decoder.scheduled_sampling_prob
+
+    
+    for epoch in range(trainingEnvironment.start_epoch, trainingEnvironment.epochs):
+
+        if epoch > 1 and argParser.use_scheduled_sampling and epoch % argParser.scheduled_sampling_decay_epochs == 0:
+            scheduled_sampling_prob += argParser.rate_change_scheduled_sampling_prob
+            decoder.scheduled_sampling_prob = scheduled_sampling_prob
+
+
+        if trainingEnvironment.epochs_since_improvement == argParser.early_stop_epoch_threshold:
+            break
+
+
+    
+        train(argParser, encoder, decoder, trainLoader, trainSentences, word2idx, idx2word, criterion, encoder_optimizer, decoder_optimizer, binary_criterion, epoch)
+
+        references, hypotheses = hierarchical_evaluate_beam(argParser, BEAM_SIZE, encoder, decoder, valLoader, word2idx, idx2word,
+                                                            detokenizer)
+
+        encoder_scheduler.step()
+        decoder_scheduler.step()
+
+        metrics_dict = nlgMetrics.compute_metrics(references, hypotheses)
+        print(metrics_dict)
+
+        with open('../Experiments/' + argParser.model_name + "/metrics.txt", "a+") as file:
+            file.write("Epoch " + str(epoch) + " results:\n")
+            for metric in metrics_dict:
+                file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
+            file.write("------------------------------------------\n")
+
+        recent_bleu4 = metrics_dict['CIDEr']
+
+    #     Check if there was an improvement
+        is_best = recent_bleu4 > trainingEnvironment.best_bleu4
+
+        trainingEnvironment.best_bleu4 = max(recent_bleu4, trainingEnvironment.best_bleu4)
+
+        print("Best BLEU: ", trainingEnvironment.best_bleu4)
+        if not is_best:
+            trainingEnvironment.epochs_since_improvement += 1
+            print("\nEpochs since last improvement: %d\n" % (trainingEnvironment.epochs_since_improvement,))
+        else:
+            trainingEnvironment.epochs_since_improvement = 0
+
+
+#        recent_bleu4 = 0
+#        is_best = True
+#        metrics_dict = {}
+
+        # Save checkpoint
+        save_checkpoint(argParser.model_name, epoch, trainingEnvironment.epochs_since_improvement, encoder.state_dict(), decoder.state_dict(), encoder_optimizer.state_dict(),
+                        decoder_optimizer.state_dict(), recent_bleu4, is_best, metrics_dict, trainingEnvironment.best_loss)
+
+    nlgMetrics.close()
+
+
+def train(argParser, encoder, decoder, trainLoader, trainSentences, word2idx, idx2word, criterion, encoder_optimizer, decoder_optimizer, binary_criterion, epoch):
+    """
+    Performs one epoch's training. Each batch is processed in two phases: the sentence LSTM runs over the
+    sentences of all the reports, then the words of all the sentences of all the reports are decoded as a
+    single word LSTM batch, with one masked loss.
+
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param encoder: Image Encoder used
+    :param decoder: Decoder to generate reports
+    :param trainLoader: data loader with training data
+    :param trainSentences: HierarchicalSentences with the sentence split reports of the training data,
+        used when the batches do not carry them
+    :param word2idx: hash table with word -> index correspondence
+    :param idx2word: hash table with index -> word correspondence
+    :param criterion: word loss, without reduction
+    :param encoder_optimizer: optimizer to update encoder's weights (if fine-tuning)
+    :param decoder_optimizer: optimizer to update decoder's weights
+    :param binary_criterion: stop loss, without reduction
+    :param epoch: epoch number
+    """
+
+
+    decoder.set_teacher_forcing_usage(argParser.use_tf_as_input)
+    decoder.train()  # train mode (dropout and batchnorm is used)
+    encoder.train()
+
+    batch_time = AverageMeter()  # forward prop. + back prop. time
+    data_time = AverageMeter()  # data loading time
+    losses = AverageMeter()  # loss (per word decoded)
+
+    start = time.time()
+
+
+    # For each batch
+    for i, batch in enumerate(trainLoader):
+
+        data_time.update(time.time() - start)
+
+        image, caps, caplens, studies = batch[:4]
+
+        # Sentences of all the reports, ordered by report then sentence
+        if len(batch) > 4:
+            # Read from the sentence store by the HierarchicalXRayDataset
+            report_sentences, report_sentences_lengths, report_lengths = [t.to(device).long() for t in batch[4:]]
+            sentences, sentences_lengths = flattenReportSentences(report_sentences, report_sentences_lengths, report_lengths)
+        else:
+            sentences, sentences_lengths, report_lengths = trainSentences.getBatch(studies)
+            sentences = sentences.to(device)  # (nr_sentences, max_sentence_length)
+            sentences_lengths = sentences_lengths.to(device)
+            report_lengths = report_lengths.to(device)
+
+        max_report_length = report_lengths.max().item()
+        max_sentence_length = sentences.size(1)
+
+        # Move to GPU device, if available
+        image = image.to(device)
+
+        # Encode
+        encoder_out = encodeImages(argParser, encoder, image)
+        encoder_dim = encoder_out.size(3)
+        batch_size = encoder_out.shape[0]
+
+        # Flatten encoding
+        encoder_out = encoder_out.view(batch_size, -1, encoder_dim)  # (batch_size, num_pixels, encoder_dim)
+
+        # Project the encoded images into the visual attention space once per report
+        projected_encoder_out = decoder.visual_attention.project_encoder(encoder_out)  # (batch_size, num_pixels, attention_dim)
+
+        #-------------------SENTENCE LSTM----------------------------------------
+        h_sent, c_sent = decoder.init_sent_hidden_state(batch_size)
+
+        topic_vectors = []
+        stop_probs = []
+        for t_s in range(max_report_length):
+            topic_vector, stop_prob, h_sent, c_sent = decoder.sentence_step(encoder_out, projected_encoder_out, h_sent, c_sent)
+            topic_vectors.append(topic_vector)
+            stop_probs.append(stop_prob)
+
+        topic_vectors = torch.stack(topic_vectors, dim=1)  # (batch_size, max_report_length, embed_dim)
+        stop_probs = torch.cat(stop_probs, dim=1)  # (batch_size, max_report_length)
+
+        sentence_positions = torch.arange(max_report_length, device=device).unsqueeze(0)  # (1, max_report_length)
+        report_mask = sentence_positions < report_lengths.unsqueeze(1)  # (batch_size, max_report_length)
+
+        # Reports still being generated at each sentence index, each one weighs 1 / unfinished_reports at that index
+        unfinished_reports = report_mask.sum(dim=0, keepdim=True).float()  # (1, max_report_length)
+        sentence_weights = report_mask.float() / unfinished_reports  # (batch_size, max_report_length)
+
+        stop_targets = (sentence_positions + 1 == report_lengths.unsqueeze(1)).float()
+        stop_loss = (binary_criterion(stop_probs, stop_targets) * sentence_weights).sum()
+
+        #-------------------WORD LSTM----------------------------------------
+        # The topic vector of each sentence of each report, in the same order as the sentences
+        topic_vectors = topic_vectors[report_mask]  # (nr_sentences, embed_dim)
+        sentence_weights = sentence_weights[report_mask]  # (nr_sentences)
+        nr_sentences = topic_vectors.size(0)
+
+        # Under teacher forcing the inputs of all the steps are known, apart from the first one
+        embeddings = decoder.embedding(sentences)  # (nr_sentences, max_sentence_length, embed_dim)
+
+        h_word, c_word = decoder.init_word_hidden_state(nr_sentences)
+
+        # Inputs of the output layer at each step, the scores are only computed for the words of the sentences
+        hiddens = []
+
+        if (argParser.word_lstm_first_input == "Topic"):
+            input = topic_vectors
+        elif (argParser.word_lstm_first_input == "Sos"):
+            input = decoder.sos_embedding.expand(nr_sentences, decoder.embed_dim).to(device)
+        for t_w in range(max_sentence_length):
+
+            h_word, c_word = decoder.word_decoder(torch.cat([topic_vectors, input], 1), (h_word, c_word))
+
+            hidden = decoder.dropout(h_word)  # (nr_sentences, hidden_dim)
+
+            hiddens.append(hidden)
+
+            if t_w > 0 and (random.random() < decoder.scheduled_sampling_prob):
+                input = decoder.embedding(torch.argmax(decoder.fc(hidden), dim=1))
+            else:
+                input = embeddings[:, t_w]
+
+        word_mask = torch.arange(max_sentence_length, device=device).unsqueeze(0) < sentences_lengths.unsqueeze(1)
+        hiddens = torch.stack(hiddens, dim=1)[word_mask]  # (nr_words, hidden_dim)
+
+        # Each sentence loss is the mean of its word losses
+        word_weights = (sentence_weights / sentences_lengths.float()).unsqueeze(1).expand_as(word_mask)[word_mask]
+        word_losses = criterion(decoder.fc(hiddens), sentences[word_mask])  # (nr_words)
+
+        loss = 5 * stop_loss + (word_losses * word_weights).sum()
+        loss = LOSS_NORMALIZATIONS[argParser.hierarchical_loss_normalization](loss, report_lengths)
+
+        decoder_optimizer.zero_grad()
+        if encoder_optimizer is not None:
+            encoder_optimizer.zero_grad()
+
+        loss.backward()
+
+
+#        if argParser.grad_clip is not None:
+#            clip_gradient(decoder_optimizer, argParser.grad_clip)
+#            if encoder_optimizer is not None:
+#                clip_gradient(encoder_optimizer, argParser.grad_clip)
+
+        decoder_optimizer.step()
+        if encoder_optimizer is not None:
+            encoder_optimizer.step()
+
+
+
+
+         # Keep track of metrics
+        losses.update(loss.item(), batch_size)
+        batch_time.update(time.time() - start)
+
+        start = time.time()
+
+        # Print status
+        if i % argParser.print_freq == 0:
+            print('Epoch: [{0}][{1}/{2}]\t'
+                  'Batch Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+                  'Data Load Time {data_time.val:.3f} ({data_time.avg:.3f})\t'
+                  'Loss {loss.val:.4f} ({loss.avg:.4f})\t'.format(epoch, i, len(trainLoader),
+                                                                          batch_time=batch_time,
+                                                                          data_time=data_time, loss=losses))
+
+    path = '../Experiments/' + argParser.model_name + '/trainLosses.txt'
+    writeLossToFile(losses.avg, path)
+
+
+
+if __name__ == '__main__':
+    main()
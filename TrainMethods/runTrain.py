@@ -15,7 +15,8 @@ import torch.backends.cudnn as cudnn
 
 from datetime import datetime
 
-from nlgeval import NLGEval
+from nlgMetrics import *
+from asyncValidation import *
 
 
 BEAM_SIZE = 4
@@ -25,10 +26,11 @@ def main():
 
     print("Starting training process MIMIC")
 
-    nlgeval = NLGEval(metrics_to_omit=['SkipThoughtCS', 'GreedyMatchingScore', 'VectorExtremaCosineSimilarity', 'EmbeddingAverageCosineSimilarity'])
-
     argParser = get_args()
 
+    # Validation metrics, the reference statistics are computed on the first validation
+    nlgMetrics = NLGMetrics(argParser.nlg_metrics_workers)
+
     if not os.path.isdir('../Experiments/' + argParser.model_name):
         os.mkdir('../Experiments/' + argParser.model_name)
 
@@ -62,75 +64,125 @@ def main():
 
     decoder_scheduler, encoder_scheduler = setupSchedulers(encoder_optimizer, decoder_optimizer, argParser)
 
-    criterion = setupCriterion(argParser.loss)
+    criterion = setupCriterion(argParser.loss, argParser, decoder.embedding.weight)
 
-    trainLoader, valLoader = setupDataLoaders(argParser)
+    trainLoader, valLoader = setupDataLoaders(argParser, encoder)
 
     # Load word <-> embeddings matrix index correspondence dictionaries
     idx2word, word2idx = loadWordIndexDicts(argParser)
 
+    # Decodes the validation references once, on the first validation
+    detokenizer = Detokenizer(idx2word, word2idx)
+
     scheduled_sampling_prob = decoder.scheduled_sampling_prob
 
     cudnn.benchmark = True  # set to true only if inputs to model are fixed size; otherwise lot of computational overhead
 
-    for epoch in range(trainingEnvironment.start_epoch, trainingEnvironment.epochs):
-
-        if epoch > 1 and argParser.use_scheduled_sampling and epoch % argParser.scheduled_sampling_decay_epochs == 0:
-            scheduled_sampling_prob += argParser.rate_change_scheduled_sampling_prob
-            #decoder.set_scheduled_sampling_prob(scheduled_sampling_prob)
-            decoder.scheduled_sampling_prob = scheduled_sampling_prob
-            print("increased scheduled sampling prob to: ", decoder.scheduled_sampling_prob)
-            print("Saved SS",scheduled_sampling_prob)
-
-        # Decay learning rate if there is no improvement for "decay_LR_epoch_threshold" consecutive epochs,
-        #  and terminate training after minimum LR has been achieved and  "early_stop_epoch_threshold" epochs without improvement
-        if trainingEnvironment.epochs_since_improvement == argParser.early_stop_epoch_threshold:
-            break
-
-        # One epoch's training
-        train(argParser,train_loader=trainLoader,
-              encoder=encoder,
-              decoder=decoder,
-              criterion=criterion,
-              encoder_optimizer=encoder_optimizer,
-              decoder_optimizer=decoder_optimizer,
-              epoch=epoch)
-
-        # One epoch's validation
-        #references, hypotheses = evaluate(argParser, 4, encoder, decoder, valLoader, word2idx, idx2word)
-        references, hypotheses = evaluate_beam(argParser, BEAM_SIZE, encoder, decoder, valLoader, word2idx, idx2word)
-
-
-        encoder_scheduler.step()
-        decoder_scheduler.step()
-
-        # nlgeval = NLGEval()
-        metrics_dict = nlgeval.compute_metrics(references, hypotheses)
-
-        print("Metrics: " , metrics_dict)
-        with open('../Experiments/' + argParser.model_name + "/metrics.txt", "a+") as file:
-            file.write("Epoch " + str(epoch) + " results:\n")
-            for metric in metrics_dict:
-                file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
-            file.write("------------------------------------------\n")
-
-        recent_bleu4 = metrics_dict['CIDEr']
-
-        # Check if there was an improvement
-        is_best = recent_bleu4 > trainingEnvironment.best_bleu4
-
-        trainingEnvironment.best_bleu4 = max(recent_bleu4, trainingEnvironment.best_bleu4)
-
-        print("Best BLEU: ", trainingEnvironment.best_bleu4)
-        if not is_best:
-            trainingEnvironment.epochs_since_improvement += 1
-            print("\nEpochs since last improvement: %d\n" % (trainingEnvironment.epochs_since_improvement,))
-        else:
-            trainingEnvironment.epochs_since_improvement = 0
-
-        # Save checkpoint
-        save_checkpoint(argParser.model_name, epoch, trainingEnvironment.epochs_since_improvement, encoder.state_dict(), decoder.state_dict(), encoder_optimizer.state_dict(),
-                        decoder_optimizer.state_dict(), recent_bleu4, is_best, metrics_dict, trainingEnvironment.best_loss)
+    # Validate each epoch in a background process while the next one trains
+    validator = AsyncValidator(argParser, evaluate_beam, BEAM_SIZE) if argParser.async_validation else None
+    metrics_dict = {}
+
+    try:
+        for epoch in range(trainingEnvironment.start_epoch, trainingEnvironment.epochs):
+
+            if epoch > 1 and argParser.use_scheduled_sampling and epoch % argParser.scheduled_sampling_decay_epochs == 0:
+                scheduled_sampling_prob += argParser.rate_change_scheduled_sampling_prob
+                #decoder.set_scheduled_sampling_prob(scheduled_sampling_prob)
+                decoder.scheduled_sampling_prob = scheduled_sampling_prob
+                print("increased scheduled sampling prob to: ", decoder.scheduled_sampling_prob)
+                print("Saved SS",scheduled_sampling_prob)
+
+            # Decay learning rate if there is no improvement for "decay_LR_epoch_threshold" consecutive epochs,
+            #  and terminate training after minimum LR has been achieved and  "early_stop_epoch_threshold" epochs without improvement
+            if trainingEnvironment.epochs_since_improvement == argParser.early_stop_epoch_threshold:
+                break
+
+            # One epoch's training
+            train(argParser,train_loader=trainLoader,
+                  encoder=encoder,
+                  decoder=decoder,
+                  criterion=criterion,
+                  encoder_optimizer=encoder_optimizer,
+                  decoder_optimizer=decoder_optimizer,
+                  epoch=epoch)
+
+            if validator is not None:
+                encoder_scheduler.step()
+                decoder_scheduler.step()
+
+                validator.submit(epoch, encoder, decoder, encoder_optimizer, decoder_optimizer)
+
+                # Apply the validations which already finished, only waiting if the one of the previous epoch did not
+                for result in validator.collect(maxPending=1):
+                    metrics_dict = apply_validation_result(argParser, trainingEnvironment, *result)
+
+                # Checkpoint of the latest weights, with the latest known metrics
+                recent_bleu4 = metrics_dict['CIDEr'] if metrics_dict else 0.
+                save_checkpoint(argParser.model_name, epoch, trainingEnvironment.epochs_since_improvement, encoder.state_dict(), decoder.state_dict(), encoder_optimizer.state_dict(),
+                                decoder_optimizer.state_dict(), recent_bleu4, False, metrics_dict, trainingEnvironment.best_loss)
+                continue
+
+            # One epoch's validation
+            #references, hypotheses = evaluate(argParser, 4, encoder, decoder, valLoader, word2idx, idx2word)
+            references, hypotheses = evaluate_beam(argParser, BEAM_SIZE, encoder, decoder, valLoader, word2idx, idx2word,
+                                                   detokenizer)
+
+
+            encoder_scheduler.step()
+            decoder_scheduler.step()
+
+            metrics_dict = nlgMetrics.compute_metrics(references, hypotheses)
+
+            snapshot = {'encoder': encoder.state_dict(), 'decoder': decoder.state_dict(),
+                        'encoder_optimizer': encoder_optimizer.state_dict(), 'decoder_optimizer': decoder_optimizer.state_dict()}
+            apply_validation_result(argParser, trainingEnvironment, epoch, metrics_dict, snapshot)
+
+        if validator is not None:
+            # Validations of the last epochs
+            for result in validator.collect():
+                apply_validation_result(argParser, trainingEnvironment, *result)
+            validator.close()
+            validator = None
+    finally:
+        # Stop the validation process if training failed or was interrupted, so that the run does not hang
+        if validator is not None:
+            validator.terminate()
+        nlgMetrics.close()
+
+
+def apply_validation_result(argParser, trainingEnvironment, epoch, metrics_dict, snapshot):
+    """
+    Log the validation metrics of an epoch, update the best metric and early stopping counter, and save the
+    checkpoint of the weights the metrics were computed with
+
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    :param trainingEnvironment: TrainingEnvironment of the run
+    :param epoch: epoch number
+    :param metrics_dict: validation metrics of the epoch
+    :param snapshot: dictionary with the encoder, decoder, encoder_optimizer and decoder_optimizer states of the epoch
+    :return: metrics_dict
+    """
+    print("Metrics: " , metrics_dict)
+    with open('../Experiments/' + argParser.model_name + "/metrics.txt", "a+") as file:
+        file.write("Epoch " + str(epoch) + " results:\n")
+        for metric in metrics_dict:
+            file.write(metric + ":" + str(metrics_dict[metric]) + "\n")
+        file.write("------------------------------------------\n")
+
+    recent_bleu4 = metrics_dict['CIDEr']
+
+    # Check if there was an improvement
+    is_best = trainingEnvironment.update_validation_metric(recent_bleu4)
+
+    print("Best BLEU: ", trainingEnvironment.best_bleu4)
+    if not is_best:
+        print("\nEpochs since last improvement: %d\n" % (trainingEnvironment.epochs_since_improvement,))
+
+    # Save checkpoint
+    save_checkpoint(argParser.model_name, epoch, trainingEnvironment.epochs_since_improvement, snapshot['encoder'], snapshot['decoder'], snapshot['encoder_optimizer'],
+                    snapshot['decoder_optimizer'], recent_bleu4, is_best, metrics_dict, trainingEnvironment.best_loss)
+
+    return metrics_dict
 
 
 
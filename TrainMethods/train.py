@@ -1,7 +1,10 @@
 import sys
 sys.path.append('../Utils/')
+sys.path.append('../')
 
 from generalUtilities import *
+from featureStore import *
+from losses import *
 #from continuousModelUtilities import *
 
 import torch
@@ -36,6 +39,11 @@ def train(argParser, train_loader, encoder, decoder, criterion, encoder_optimize
     losses = AverageMeter()  # loss (per word decoded)
     top5accs = AverageMeter()  # top5 accuracy
 
+    # Compute the softmax loss from the decoder hidden states in chunks, without the (words, vocab_size) scores
+    fused_softmax_loss = argParser.model == 'Softmax' and argParser.fused_softmax_loss
+    if fused_softmax_loss:
+        chunked_criterion = ChunkedSoftmaxCrossEntropyLoss(argParser.loss_chunk_size)
+
     start = time.time()
 
     # Batches
@@ -48,12 +56,14 @@ def train(argParser, train_loader, encoder, decoder, criterion, encoder_optimize
         caplens = caplens.to(device)
 
         # Forward prop.
-        if (argParser.use_classifier_encoder):
-            imgs, _ = encoder(imgs)
-        else:
-            imgs = encoder(imgs)
-
-        decoder_output, caps_sorted, decode_lengths, alphas, sort_ind = decoder(imgs, caps, caplens)
+        imgs = encodeImages(argParser, encoder, imgs)
+
+        decoder_kwargs = {'return_hidden': True} if fused_softmax_loss else {}
+        # Only the sum of the attention weights over the decoded steps is needed for the regularization
+        decoder_output, caps_sorted, decode_lengths, alpha_sums, sort_ind = decoder(imgs, caps, caplens,
+                                                                                    presorted=argParser.presort_batches,
+                                                                                    return_alphas=False,
+                                                                                    **decoder_kwargs)
         # Since we decoded starting with <start>, the targets are all words after <start>, up to <end>
         if (argParser.use_img_embedding):
             img_embeddings =  decoder_output[1]
@@ -81,13 +91,16 @@ def train(argParser, train_loader, encoder, decoder, criterion, encoder_optimize
             decoder_output = pack_padded_sequence(decoder_output, decode_lengths, batch_first=True)
             #print(targets)
             targets = pack_padded_sequence(targets, decode_lengths, batch_first=True)
-            loss = criterion(decoder_output.data, targets.data)
+            if fused_softmax_loss:
+                loss = chunked_criterion(decoder_output.data, decoder.fc, targets.data)
+            else:
+                loss = criterion(decoder_output.data, targets.data)
 
 
         #print(loss)
 
         # Add doubly stochastic attention regularization
-        loss += argParser.alpha_c * ((1. - alphas.sum(dim=1)) ** 2).mean()
+        loss += argParser.alpha_c * ((1. - alpha_sums) ** 2).mean()
 
         #print("Final loss",loss)
 
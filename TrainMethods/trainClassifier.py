@@ -53,6 +53,8 @@ def main():
 
     cudnn.benchmark = True  # set to true only if inputs to model are fixed size; otherwise lot of computational overhead
 
+    trainLoader, valLoader = setupClassifierDataLoaders(argParser)
+
 
     for epoch in range(trainingEnvironment.start_epoch, trainingEnvironment.epochs):
 
@@ -62,9 +64,9 @@ def main():
             break
 
         # One epoch's training
-        _ = runEpochs(epoch, "Train", encoder, criterion, encoder_optimizer, argParser)
+        _ = runEpochs(epoch, "Train", encoder, criterion, encoder_optimizer, argParser, trainLoader)
 
-        recent_loss = runEpochs(epoch, "Test", encoder, criterion, encoder_optimizer, argParser)
+        recent_loss = runEpochs(epoch, "Test", encoder, criterion, encoder_optimizer, argParser, valLoader)
 
         enc_scheduler.step()
 
@@ -89,28 +91,38 @@ def main():
 
 
 
-def runEpochs(epoch, mode, encoder, criterion, encoder_optimizer, argParser):
+def setupClassifierDataLoaders(argParser):
+    """
+    Create the train and validation loaders of the classifier, once for the whole training
+    :param argParser: Argument Parser object with definitions set in a specified config file
+    """
+    # Single channel uint8 images, normalized by the encoder
+    transform = transforms.Compose([
+    transforms.Grayscale(num_output_channels=1),
+    transforms.PILToTensor()
+    ])
 
+    trainLoader = DataLoader(ClassXRayDataset(argParser.trainImgsPath, argParser.csv_path, transform, argParser.trainImgsManifestPath,
+        argParser.trainImgsShardsPath), batch_size=argParser.batch_size, shuffle=True, collate_fn=collate_class_batch,
+        **getLoaderOptions(argParser))
 
+    valLoader = DataLoader(ClassXRayDataset( argParser.valImgsPath, argParser.csv_path, transform, argParser.valImgsManifestPath,
+        argParser.valImgsShardsPath), batch_size=argParser.batch_size, shuffle=True, collate_fn=collate_class_batch,
+        **getLoaderOptions(argParser))
 
-    transform = transforms.Compose([
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225])
-    ])
+    return trainLoader, valLoader
 
 
+def runEpochs(epoch, mode, encoder, criterion, encoder_optimizer, argParser, loader):
+    """
+    Run one epoch of training (mode Train) or of evaluation without weight updates (mode Test)
+    :return: average loss of the epoch
+    """
     if (mode =='Train'):
         encoder.train()
-        loader = DataLoader(ClassXRayDataset(argParser.trainImgsPath, argParser.csv_path, transform), batch_size=argParser.batch_size, shuffle=True)
-
-
 
     elif (mode =='Test'):
-        loader = DataLoader(ClassXRayDataset( argParser.valImgsPath, argParser.csv_path, transform), batch_size=argParser.batch_size, shuffle=True)
-
-
-
+        encoder.eval()
 
     batch_time = AverageMeter()  # forward prop. + back prop. time
     data_time = AverageMeter()  # data loading time
@@ -125,19 +137,22 @@ def runEpochs(epoch, mode, encoder, criterion, encoder_optimizer, argParser):
         data_time.update(time.time() - start)
 
         # Move to GPU, if available
-        imgs = imgs.to(device)
-    
-        features, pred_labels_logits = encoder(imgs)
+        imgs = imgs.to(device, non_blocking=True)
+        target_labels = target_labels.to(device, non_blocking=True)
+
+        with torch.set_grad_enabled(mode == 'Train'):
+            features, pred_labels_logits = encoder(imgs)
 
-        loss = criterion(pred_labels_logits, reshape_target_labels(target_labels).to(device))
+            loss = criterion(pred_labels_logits, target_labels)
 
-        encoder_optimizer.zero_grad()
-        loss.backward()
+        if (mode == 'Train'):
+            encoder_optimizer.zero_grad()
+            loss.backward()
 
-        if argParser.grad_clip is not None:
-            clip_gradient(encoder_optimizer, argParser.grad_clip)
+            if argParser.grad_clip is not None:
+                clip_gradient(encoder_optimizer, argParser.grad_clip)
 
-        encoder_optimizer.step()
+            encoder_optimizer.step()
 
         batch_size = imgs.shape[0]
 
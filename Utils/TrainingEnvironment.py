@@ -34,4 +34,23 @@ class TrainingEnvironment:
       self.early_stop_epoch_threshold = args.early_stop_epoch_threshold
 
 
+    def update_validation_metric(self, metric):
+      """
+        Keep track of the best validation metric and of the epochs since it last improved, which decide the
+        best checkpoint and early stopping
+        :param metric: validation metric (CIDEr) of an epoch
+        :return: is it the best metric so far?
+      """
+      is_best = metric > self.best_bleu4
+
+      self.best_bleu4 = max(metric, self.best_bleu4)
+
+      if not is_best:
+        self.epochs_since_improvement += 1
+      else:
+        self.epochs_since_improvement = 0
+
+      return is_best
+
+
 
@@ -31,6 +31,52 @@ def get_args():
     parser.add_argument('--batch_size', type=int, default=16,
                         help='define batch size to train the model')
 
+    parser.add_argument('--eval_batch_size', type=int, default=1,
+                        help='define batch size used to decode the validation set during training')
+
+    parser.add_argument('--bucket_batches', type=bool, default=False,
+                        help='group training captions of similar length in the same batch and pad them only to the batch maximum?')
+
+    parser.add_argument('--bucket_size_multiplier', type=int, default=100,
+                        help='number of batches in each bucket of captions sorted by length')
+
+    parser.add_argument('--presort_batches', type=bool, default=False,
+                        help='sort training batches by caption length when collating instead of in the decoder?')
+    parser.add_argument('--fused_softmax_loss', type=bool, default=False,
+                        help='compute the Softmax model loss from the decoder hidden states in chunks of words, without storing the vocabulary scores?')
+    parser.add_argument('--loss_chunk_size', type=int, default=1024,
+                        help='number of words per chunk of the fused softmax loss')
+
+    parser.add_argument('--image_size', type=int, default=256,
+                        help='side of the images written in the image shards (0: keep the original size)')
+
+    parser.add_argument('--image_shard_size', type=int, default=4096,
+                        help='number of images in each image shard')
+
+    parser.add_argument('--preprocessing_workers', type=int, default=8,
+                        help='number of processes decoding images when building the image shards')
+
+    parser.add_argument('--use_feature_store', type=bool, default=False,
+                        help='read the encoded images from an offline feature store when the encoder is frozen?')
+
+    parser.add_argument('--feature_store_path', type=str, default='../FeatureStores',
+                        help='path to the directory where the feature stores are kept')
+
+    parser.add_argument('--feature_store_fp16', type=bool, default=False,
+                        help='keep the encoded images in the feature store as float16?')
+
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='number of data loader worker processes')
+
+    parser.add_argument('--persistent_workers', type=bool, default=False,
+                        help='keep the data loader workers alive between epochs?')
+
+    parser.add_argument('--prefetch_factor', type=int, default=2,
+                        help='number of batches loaded in advance by each data loader worker')
+
+    parser.add_argument('--pin_memory', type=bool, default=False,
+                        help='copy batches into pinned memory for faster host to device transfers?')
+
     parser.add_argument('--csv_path', type=str, default="",
                         help='path to the csv file with disease labels')
 
@@ -49,6 +95,12 @@ def get_args():
     parser.add_argument('--testImgsPath', type=str, default='',
                         help='path to the images to be used')
 
+    parser.add_argument('--testImgsManifestPath', type=str, default='',
+                        help='path to the manifest of the images, built on first use (empty: walk the images directory)')
+
+    parser.add_argument('--testImgsShardsPath', type=str, default='',
+                        help='path to the pre-decoded image shards (empty: decode the images)')
+
     parser.add_argument('--encodedTrainCaptionsPath', type=str, default="",
                         help='path to the encoded captions to be used')
 
@@ -58,6 +110,12 @@ def get_args():
     parser.add_argument('--trainImgsPath', type=str, default='',
                         help='path to the images to be used')
 
+    parser.add_argument('--trainImgsManifestPath', type=str, default='',
+                        help='path to the manifest of the images, built on first use (empty: walk the images directory)')
+
+    parser.add_argument('--trainImgsShardsPath', type=str, default='',
+                        help='path to the pre-decoded image shards (empty: decode the images)')
+
     parser.add_argument('--encodedValCaptionsPath', type=str, default="",
                         help='path to the encoded captions to be used')
 
@@ -67,6 +125,33 @@ def get_args():
     parser.add_argument('--valImgsPath', type=str, default='',
                         help='path to the images to be used')
 
+    parser.add_argument('--valImgsManifestPath', type=str, default='',
+                        help='path to the manifest of the images, built on first use (empty: walk the images directory)')
+
+    parser.add_argument('--valImgsShardsPath', type=str, default='',
+                        help='path to the pre-decoded image shards (empty: decode the images)')
+
+    parser.add_argument('--trainCaptionStorePath', type=str, default='',
+                        help='path to the caption store of the train split (empty: read the json captions)')
+
+    parser.add_argument('--valCaptionStorePath', type=str, default='',
+                        help='path to the caption store of the val split (empty: read the json captions)')
+
+    parser.add_argument('--testCaptionStorePath', type=str, default='',
+                        help='path to the caption store of the test split (empty: read the json captions)')
+
+    parser.add_argument('--trainSentencesPath', type=str, default='',
+                        help='path to the sentence split train reports used by the hierarchical models')
+
+    parser.add_argument('--trainSentencesLengthsPath', type=str, default='',
+                        help='path to the lengths of the sentences of the train reports')
+
+    parser.add_argument('--trainReportLengthInSentencesPath', type=str, default='',
+                        help='path to the lengths in sentences of the train reports')
+
+    parser.add_argument('--trainSentenceStorePath', type=str, default='',
+                        help='path to the sentence store of the train reports (empty: read the json sentences)')
+
     parser.add_argument('--embeddingsPath', type=str, default='',
                         help='path to the embeddings dictionary')
 
@@ -77,10 +162,25 @@ def get_args():
                         help='margin used in triplet margin loss computation')
 
     parser.add_argument('--triplet_loss_mode', type=str, default='Ortho',
-                        help='Negative sampling mode: Ortho, Dif, MINS.')
+                        help='Negative sampling mode: Ortho, Diff, MINS.')
+
+    parser.add_argument('--triplet_loss_negatives', type=int, default=10,
+                        help='number of vocabulary embeddings mined per target word in the MINS triplet loss mode')
+
+    parser.add_argument('--hierarchical_loss_normalization', type=str, default='Sum',
+                        help='normalization of the hierarchical loss of a batch: Sum / MaxReportLength')
+
+    parser.add_argument('--word_lstm_first_input', type=str, default='Topic',
+                        help='first input of the hierarchical word LSTM: Topic / Sos')
 
     parser.add_argument('--normalizeEmb', type=bool, default=False,
                         help='normalize embeddings?')
+    parser.add_argument('--async_validation', type=bool, default=False,
+                        help='validate each epoch in a background process, on a snapshot of the weights, while the next epoch trains?')
+    parser.add_argument('--nlg_metrics_workers', type=int, default=4,
+                        help='number of processes scoring the validation hypotheses (BLEU, ROUGE-L and CIDEr) during training')
+    parser.add_argument('--nearest_word_precision', type=str, default='fp32',
+                        help='precision of the normalized embeddings used to find the nearest word of continuous outputs: fp32 / fp16 / int8')
 
     parser.add_argument('--attention_dim', type=int,
                         default=512, help='define attention dim')
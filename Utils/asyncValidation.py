@@ -0,0 +1,146 @@
+import copy
+import queue
+import torch
+import torch.multiprocessing as mp
+
+
+# Seconds between checks that the validation process is still alive while waiting for its results
+RESULT_POLL_INTERVAL = 10
+# Seconds given to the validation process to exit by itself before it is terminated
+TERMINATE_TIMEOUT = 10
+
+
+def snapshotStateDict(module):
+  """
+    Copy of the weights of a model in host memory, unaffected by the following optimizer steps
+  """
+  return {name: tensor.detach().to('cpu', copy=True) for name, tensor in module.state_dict().items()}
+
+
+def snapshotOptimizer(optimizer):
+  """
+    Copy of the state of an optimizer in host memory, or None without optimizer
+  """
+  if optimizer is None:
+    return None
+  state = optimizer.state_dict()
+  return {'state': {param: {name: value.detach().to('cpu', copy=True) if torch.is_tensor(value) else copy.deepcopy(value)
+                            for name, value in paramState.items()}
+                    for param, paramState in state['state'].items()},
+          'param_groups': copy.deepcopy(state['param_groups'])}
+
+
+def _validationWorker(args, evaluate, beamSize, jobs, results):
+  """
+    Validation process: builds its own copy of the model and of the validation loader on the first job, then
+    for each snapshot of the weights it receives generates the validation reports and computes their metrics
+  """
+  from setupEnvironment import setupEncoderDecoder, setupValLoader, loadWordIndexDicts
+  from generalUtilities import Detokenizer
+  from nlgMetrics import NLGMetrics
+
+  idx2word, word2idx = loadWordIndexDicts(args)
+  detokenizer = Detokenizer(idx2word, word2idx)
+  nlgMetrics = NLGMetrics(args.nlg_metrics_workers)
+
+  encoder = None
+  while True:
+    job = jobs.get()
+    if job is None:
+      break
+
+    epoch, encoderState, decoderState = job
+    if encoder is None:
+      encoder, decoder = setupEncoderDecoder(args, {'encoder': encoderState, 'decoder': decoderState})
+      valLoader = setupValLoader(args, encoder)
+    else:
+      encoder.load_state_dict(encoderState)
+      decoder.load_state_dict(decoderState)
+
+    references, hypotheses = evaluate(args, beamSize, encoder, decoder, valLoader, word2idx, idx2word, detokenizer)
+    results.put((epoch, nlgMetrics.compute_metrics(references, hypotheses)))
+
+  nlgMetrics.close()
+
+
+class AsyncValidator(object):
+  """
+    Runs the validation of each epoch in a background process, against a snapshot of the weights taken at the
+    end of the epoch, while the next epochs train. The snapshot, with the optimizer states, is kept until the
+    metrics of its epoch arrive so that it can be saved as the best checkpoint.
+  """
+
+  def __init__(self, args, evaluate, beamSize):
+    """
+      :param args: Argument Parser object with definitions set in a specified config file
+      :param evaluate: evaluation function, with the signature of evaluate_beam
+      :param beamSize: beam size of the validation
+    """
+    # The validation process uses the GPU, so it can not be forked
+    context = mp.get_context('spawn')
+    self.jobs = context.Queue()
+    self.results = context.Queue()
+    # Not a daemon, as the validation loader starts its own worker processes
+    self.process = context.Process(target=_validationWorker, args=(args, evaluate, beamSize, self.jobs, self.results))
+    self.process.start()
+    self.pending = {}
+
+  def submit(self, epoch, encoder, decoder, encoderOptimizer, decoderOptimizer):
+    """
+      Queue the validation of the current weights
+      :param epoch: epoch number
+    """
+    snapshot = {'encoder': snapshotStateDict(encoder),
+                'decoder': snapshotStateDict(decoder),
+                'encoder_optimizer': snapshotOptimizer(encoderOptimizer),
+                'decoder_optimizer': snapshotOptimizer(decoderOptimizer)}
+    self.pending[epoch] = snapshot
+    self.jobs.put((epoch, snapshot['encoder'], snapshot['decoder']))
+
+  def getResult(self, block):
+    if not block:
+      return self.results.get_nowait()
+    while True:
+      try:
+        return self.results.get(timeout=RESULT_POLL_INTERVAL)
+      except queue.Empty:
+        if not self.process.is_alive():
+          raise RuntimeError("The validation process exited with code " + str(self.process.exitcode))
+
+  def collect(self, maxPending=0):
+    """
+      Results of the validations that already finished, waiting for more only while more than maxPending
+      validations are still running
+      :param maxPending: number of validations which may still be running when returning
+      :return: list of (epoch, metrics dictionary, snapshot) in epoch order
+    """
+    arrived = []
+    while self.pending:
+      try:
+        epoch, metrics = self.getResult(block=len(self.pending) > maxPending)
+      except queue.Empty:
+        break
+      arrived.append((epoch, metrics, self.pending.pop(epoch)))
+    return arrived
+
+  def close(self):
+    """
+      Stop the validation process, once the queued validations are finished and collected
+    """
+    self.jobs.put(None)
+    self.process.join()
+
+  def terminate(self):
+    """
+      Stop the validation process without waiting for the queued validations, e.g. when training failed. The
+      process is given TERMINATE_TIMEOUT seconds to exit by itself and is then terminated.
+    """
+    # The snapshots which are still queued must not keep the training process alive at exit
+    self.jobs.cancel_join_thread()
+    if self.process.is_alive():
+      self.jobs.put(None)
+      self.process.join(TERMINATE_TIMEOUT)
+    if self.process.is_alive():
+      self.process.terminate()
+      self.process.join()
+    self.pending = {}
@@ -0,0 +1,138 @@
+import torch
+
+
+def beam_search(step_function, state, context, batch_size, beam_size, start_index, end_index, max_steps,
+                min_end_step=1):
+    """
+    Batched beam search. The batch_size instances x beam_size beams are decoded as a single
+    (batch_size * beam_size) batch, the beams of each instance occupying consecutive rows.
+    Reproduces the per-instance search: at each step an instance with k live beams keeps the k best
+    expansions, expansions ending in end_index are set aside and the instance continues with one beam less.
+    Beams that are no longer live are masked out; instances with no live beams are dropped from the batch.
+
+    :param step_function: function (prev_words, state, context, step) -> (scores, state) where scores is a
+        tensor of dimension (rows, vocab_size) with the score of each word, added to the hypothesis score
+    :param state: tuple of tensors of dimension (batch_size * beam_size, ...) which follow the beams (e.g. h, c)
+    :param context: tuple of tensors of dimension (batch_size * beam_size, ...) constant along the decoding
+        of an instance (e.g. encoder output); only reindexed when instances leave the batch
+    :param batch_size: number of instances
+    :param beam_size: number of beams per instance
+    :param start_index: index of the word which starts every sequence
+    :param end_index: index of the word which completes a sequence
+    :param max_steps: decoding stops after step max_steps + 1, using the incomplete sequences of instances
+        which never completed one
+    :param min_end_step: end_index only completes a sequence from this step on
+    :return: list with the best sequence of each instance (list of word indices, starting with start_index)
+    """
+    k = beam_size
+    device = context[0].device if len(context) > 0 else state[0].device
+    max_width = max_steps + 2
+
+    # Original batch position of the instances still being decoded
+    instance_ids = torch.arange(batch_size, device=device)
+    beam_positions = torch.arange(k, device=device).unsqueeze(0)  # (1, k)
+
+    # Number of beams each instance is still searching with
+    nr_live = torch.full((batch_size,), k, dtype=torch.long, device=device)
+    # On the first step all beams of an instance are the same, so only the first one is expanded
+    live = beam_positions.expand(batch_size, k) == 0  # (batch_size, k)
+
+    seqs = torch.full((batch_size * k, 1), start_index, dtype=torch.long, device=device)
+    prev_words = seqs[:, 0]
+    top_k_scores = torch.zeros(batch_size, k, device=device)
+
+    # Best complete sequence of each instance
+    best_scores = torch.full((batch_size,), float('-inf'), device=device)
+    best_seqs = torch.full((batch_size, max_width), end_index, dtype=torch.long, device=device)
+    best_lengths = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    step = 1
+    while True:
+        nr_instances = instance_ids.size(0)
+        rows = nr_instances * k
+
+        scores, state = step_function(prev_words, state, context, step)  # (rows, vocab_size)
+        vocab_size = scores.size(1)
+
+        scores = top_k_scores.view(rows, 1) + scores
+        scores = scores.masked_fill(~live.view(rows, 1), float('-inf'))
+
+        # Unroll the beams of each instance and find top scores, and their unrolled indices
+        top_k_scores, top_k_words = scores.view(nr_instances, -1).topk(k, 1, True, True)  # (nr_instances, k)
+
+        # Convert unrolled indices to actual indices of scores
+        prev_beam_inds = top_k_words // vocab_size
+        next_word_inds = top_k_words % vocab_size
+        source_rows = (prev_beam_inds + torch.arange(nr_instances, device=device).unsqueeze(1) * k).view(-1)
+
+        # Add new words to sequences
+        seqs = torch.cat([seqs[source_rows], next_word_inds.view(-1, 1)], dim=1)  # (rows, step + 1)
+
+        # Only the first nr_live expansions of each instance are kept
+        valid = beam_positions < nr_live.unsqueeze(1)
+        if step >= min_end_step:
+            complete = valid & (next_word_inds == end_index)
+        else:
+            complete = torch.zeros_like(valid)
+        incomplete = valid & ~complete
+
+        # Set aside the best complete sequence of each instance (the first one on ties)
+        complete_scores = top_k_scores.masked_fill(~complete, float('-inf'))
+        step_best_scores, step_best_beams = complete_scores.max(dim=1)
+        improved = step_best_scores > best_scores[instance_ids]
+        width = seqs.size(1)
+        step_best_seqs = seqs.view(nr_instances, k, width)[torch.arange(nr_instances, device=device), step_best_beams]
+        best_scores[instance_ids] = torch.where(improved, step_best_scores, best_scores[instance_ids])
+        best_seqs[instance_ids, :width] = torch.where(improved.unsqueeze(1), step_best_seqs,
+                                                      best_seqs[instance_ids, :width])
+        best_lengths[instance_ids] = torch.where(improved, torch.full_like(best_lengths[instance_ids], width),
+                                                 best_lengths[instance_ids])
+
+        # Reduce beam length accordingly and move the incomplete sequences to the first beams
+        nr_live = nr_live - complete.sum(dim=1)
+        order = ((~incomplete).long() * k + beam_positions).argsort(dim=1)  # (nr_instances, k)
+        order_rows = (order + torch.arange(nr_instances, device=device).unsqueeze(1) * k).view(-1)
+
+        seqs = seqs[order_rows]
+        top_k_scores = top_k_scores.gather(1, order)
+        prev_words = next_word_inds.gather(1, order).view(-1)
+        state = tuple(s[source_rows[order_rows]] for s in state)
+        live = beam_positions < nr_live.unsqueeze(1)
+
+        finished = nr_live == 0
+        if bool(finished.all()):
+            break
+
+        # Break if things have been going on too long
+        if step > max_steps:
+            break
+        step += 1
+
+        # Drop instances whose beams have all completed
+        if bool(finished.any()):
+            keep = (~finished).nonzero().squeeze(1)
+            keep_rows = (keep.unsqueeze(1) * k + beam_positions).view(-1)
+            instance_ids = instance_ids[keep]
+            nr_live = nr_live[keep]
+            live = live[keep]
+            top_k_scores = top_k_scores[keep]
+            seqs = seqs[keep_rows]
+            prev_words = prev_words[keep_rows]
+            state = tuple(s[keep_rows] for s in state)
+            context = tuple(c[keep_rows] for c in context)
+
+    # If max_steps has been reached and an instance has no complete sequence
+    # use its best incomplete one
+    no_complete = nr_live == k
+    if bool(no_complete.any()):
+        nr_instances = instance_ids.size(0)
+        width = seqs.size(1)
+        _, best_beams = top_k_scores.masked_fill(~live, float('-inf')).max(dim=1)
+        fallback_seqs = seqs.view(nr_instances, k, width)[torch.arange(nr_instances, device=device), best_beams]
+        ids = instance_ids[no_complete]
+        best_seqs[ids, :width] = fallback_seqs[no_complete]
+        best_lengths[ids] = width
+
+    best_seqs = best_seqs.tolist()
+    best_lengths = best_lengths.tolist()
+    return [seq[:length] for seq, length in zip(best_seqs, best_lengths)]
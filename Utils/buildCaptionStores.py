@@ -0,0 +1,32 @@
+import sys
+sys.path.append('../Utils/')
+
+from argParser import *
+from captionStore import *
+
+
+def main():
+    """
+    Convert the json captions of the splits used by the run type set in the config file (Testing: test split,
+    Training: train and val splits) into the caption stores given by the caption store paths.
+    """
+    argParser = get_args()
+
+    if (argParser.runType == "Testing"):
+        splits = [(argParser.encodedTestCaptionsPath, argParser.encodedTestCaptionsLengthsPath,
+                   argParser.testCaptionStorePath)]
+    elif (argParser.runType == "Training"):
+        splits = [(argParser.encodedTrainCaptionsPath, argParser.encodedTrainCaptionsLengthsPath,
+                   argParser.trainCaptionStorePath),
+                  (argParser.encodedValCaptionsPath, argParser.encodedValCaptionsLengthsPath,
+                   argParser.valCaptionStorePath)]
+
+    for captionsPath, captionsLengthsPath, storePath in splits:
+        if not storePath:
+            continue
+        print("Building caption store", storePath, "from", captionsPath)
+        buildCaptionStoreFromJson(argParser.word2idxPath, captionsPath, captionsLengthsPath, storePath)
+
+
+if __name__ == "__main__":
+    main()
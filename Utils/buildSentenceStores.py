@@ -0,0 +1,21 @@
+import sys
+sys.path.append('../Utils/')
+
+from argParser import *
+from hierarchicalSentences import *
+
+
+def main():
+    """
+    Convert the json sentence split train reports used by the hierarchical models into the sentence store
+    given by the train sentence store path.
+    """
+    argParser = get_args()
+
+    print("Building sentence store", argParser.trainSentenceStorePath, "from", argParser.trainSentencesPath)
+    buildSentenceStoreFromJson(argParser.word2idxPath, argParser.trainSentencesPath, argParser.trainSentencesLengthsPath,
+                               argParser.trainReportLengthInSentencesPath, argParser.trainSentenceStorePath)
+
+
+if __name__ == "__main__":
+    main()
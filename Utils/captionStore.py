@@ -0,0 +1,107 @@
+import numpy as np
+import json
+import os
+
+
+TOKENS_FILE = 'tokens.npy'
+OFFSETS_FILE = 'offsets.npy'
+STUDIES_FILE = 'studies.npy'
+
+
+def buildCaptionStore(word2idx, encodedCaptions, encodedCaptionsLength, storePath):
+  """
+    Convert the captions of a split into a caption store: the encoded captions of all studies (with start and
+    end of caption tokens) concatenated in a flat int32 array, the offsets of each caption in that array and
+    the sorted study ids
+    :param word2idx: hash table with word -> index correspondence
+    :param encodedCaptions: dictionary with study -> list of words of the caption
+    :param encodedCaptionsLength: dictionary with study -> caption length
+    :param storePath: path to the store directory
+  """
+  studies = sorted(encodedCaptions.keys(), key=int)
+
+  offsets = np.zeros(len(studies) + 1, dtype=np.int64)
+  for n, study in enumerate(studies):
+    if len(encodedCaptions[study]) != encodedCaptionsLength[study]:
+      raise ValueError("Caption of study " + study + " does not match its length")
+    offsets[n + 1] = offsets[n] + encodedCaptionsLength[study] + 2
+
+  unk = word2idx['<unk>']
+  tokens = np.zeros(offsets[-1], dtype=np.int32)
+  for n, study in enumerate(studies):
+    caption = [word2idx['<sos>']] + [word2idx.get(word, unk) for word in encodedCaptions[study]] + [word2idx['<eoc>']]
+    tokens[offsets[n]:offsets[n + 1]] = caption
+
+  if not os.path.isdir(storePath):
+    os.makedirs(storePath)
+
+  np.save(os.path.join(storePath, TOKENS_FILE), tokens)
+  np.save(os.path.join(storePath, OFFSETS_FILE), offsets)
+  np.save(os.path.join(storePath, STUDIES_FILE), np.array([int(study) for study in studies], dtype=np.int64))
+
+
+def buildCaptionStoreFromJson(word2idx_path, encodedCaptionsJsonFile, captionsLengthsFile, storePath):
+  """
+    Build a caption store from the json files with the captions and captions lengths of a split
+  """
+  with open(word2idx_path) as json_file:
+    word2idx = json.load(json_file)
+
+  with open(encodedCaptionsJsonFile) as json_file:
+    encodedCaptions = json.load(json_file)
+
+  with open(captionsLengthsFile) as json_file:
+    encodedCaptionsLength = json.load(json_file)
+
+  buildCaptionStore(word2idx, encodedCaptions, encodedCaptionsLength, storePath)
+
+
+class CaptionStore(object):
+  """
+    Read access to a caption store built by buildCaptionStore. The arrays are memory mapped when first
+    accessed, so that each data loader worker opens its own maps.
+  """
+
+  def __init__(self, storePath):
+    self.storePath = storePath
+    self.tokens = None
+    self.offsets = None
+    self.studies = None
+
+  def open(self):
+    self.tokens = np.load(os.path.join(self.storePath, TOKENS_FILE), mmap_mode='r')
+    self.offsets = np.load(os.path.join(self.storePath, OFFSETS_FILE), mmap_mode='r')
+    self.studies = np.load(os.path.join(self.storePath, STUDIES_FILE), mmap_mode='r')
+
+  def __len__(self):
+    if self.studies is None:
+      self.open()
+    return len(self.studies)
+
+  def getIndex(self, study):
+    """
+      Position of a study in the store
+      :param study: study id (string or int)
+    """
+    if self.studies is None:
+      self.open()
+    idx = int(np.searchsorted(self.studies, int(study)))
+    if idx == len(self.studies) or self.studies[idx] != int(study):
+      raise KeyError(study)
+    return idx
+
+  def getCaption(self, study):
+    """
+      Encoded caption of a study, with start and end of caption tokens, as a view of the memory map
+      :param study: study id (string or int)
+    """
+    idx = self.getIndex(study)
+    return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+  def getLength(self, study):
+    """
+      Length of the encoded caption of a study, with start and end of caption tokens
+      :param study: study id (string or int)
+    """
+    idx = self.getIndex(study)
+    return int(self.offsets[idx + 1] - self.offsets[idx])
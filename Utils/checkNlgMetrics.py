@@ -0,0 +1,89 @@
+import sys
+sys.path.append('../Utils/')
+
+from nlgMetrics import *
+
+
+# Reports of a small fixed corpus, with a second set of references and an empty hypothesis
+REFERENCES = [
+  "the lungs are clear . there is no pleural effusion or pneumothorax .",
+  "heart size is normal . no focal consolidation .",
+  "small left pleural effusion with adjacent atelectasis . no pneumothorax .",
+  "there is mild cardiomegaly . the lungs are clear .",
+  "no acute cardiopulmonary process .",
+  "right lower lobe opacity concerning for pneumonia . no effusion .",
+]
+SECOND_REFERENCES = [
+  "lungs are clear without effusion or pneumothorax .",
+  "normal heart size . lungs are clear .",
+  "left pleural effusion and basilar atelectasis .",
+  "mild enlargement of the cardiac silhouette . no consolidation .",
+  "no acute cardiopulmonary abnormality .",
+  "right lower lobe pneumonia . no pleural effusion .",
+]
+HYPOTHESES = [
+  "the lungs are clear . no pleural effusion or pneumothorax .",
+  "heart size is normal . the lungs are clear .",
+  "",
+  "there is cardiomegaly . no pleural effusion .",
+  "no acute cardiopulmonary process .",
+  "right lower lobe opacity . no pneumothorax . no pneumothorax .",
+]
+
+# Scores of pycocoevalcap 1.2 (Bleu(4), Rouge and Cider, as used by NLGEval) on the cases below
+CASES = [
+  ("One reference", [REFERENCES], HYPOTHESES,
+   {'Bleu_1': 0.553544531156139, 'Bleu_2': 0.4828956410147624, 'Bleu_3': 0.41834891668681745,
+    'Bleu_4': 0.36567495207822337, 'ROUGE_L': 0.6202887856789722, 'CIDEr': 4.467329801856336}),
+  ("Two references", [REFERENCES, SECOND_REFERENCES], HYPOTHESES,
+   {'Bleu_1': 0.676178251321919, 'Bleu_2': 0.6045434817873505, 'Bleu_3': 0.5218856546626953,
+    'Bleu_4': 0.4519827975533862, 'ROUGE_L': 0.6524124047402963, 'CIDEr': 3.396298982864851}),
+  ("Single image", [REFERENCES[:1]], HYPOTHESES[:1],
+   {'Bleu_1': 0.8337529179235894, 'Bleu_2': 0.7909674679313948, 'Bleu_3': 0.7402925522816967,
+    'Bleu_4': 0.6780814772600793, 'ROUGE_L': 0.9030955585464334, 'CIDEr': 0.0}),
+]
+
+TOLERANCE = 1e-12
+
+
+def checkCase(nlgMetrics, name, refList, hypList, expected):
+  """
+    Compare the metrics of a case with the pycocoevalcap scores
+    :return: True if every metric matches
+  """
+  metrics = nlgMetrics.compute_metrics(refList, hypList)
+  matches = sorted(metrics) == sorted(expected)
+  for metric in sorted(expected):
+    difference = abs(metrics.get(metric, float('nan')) - expected[metric])
+    if not difference <= TOLERANCE:
+      print(name, metric, "expected", expected[metric], "got", metrics.get(metric))
+      matches = False
+  return matches
+
+
+def main():
+  """
+    Regression check of NLGMetrics against the scores of pycocoevalcap, which NLGEval uses, on a fixed corpus,
+    scoring in the calling process and with a pool of workers
+  """
+  passed = True
+  for nrWorkers in [0, 2]:
+    nlgMetrics = NLGMetrics(nrWorkers)
+    for name, refList, hypList, expected in CASES:
+      passed = checkCase(nlgMetrics, name + " (" + str(nrWorkers) + " workers)", refList, hypList, expected) and passed
+    nlgMetrics.close()
+
+  try:
+    NLGMetrics(0).compute_metrics([[]], [])
+    print("No hypotheses: expected a ValueError")
+    passed = False
+  except ValueError:
+    pass
+
+  print("NLGMetrics check", "passed" if passed else "FAILED")
+  if not passed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
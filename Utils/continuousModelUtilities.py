@@ -1,5 +1,9 @@
+import sys
+sys.path.append('../Models/')
+
 import torch
 import torch.nn as nn
+from NearestWordIndex import NearestWordIndex
 
 
 
@@ -8,13 +12,13 @@ def findClosestWord(continuousOutput, embeddings, idx2word):
   """
     Get nearest neighbour to the continuous output provided by the model
     :param continuousOutput: continuous output of size embed_dim
-    :param embeddings: embeddings matrix.
+    :param embeddings: embeddings matrix or NearestWordIndex built from it.
     :param idx2word: dictionary with index -> word correspondence.
   """
-  cos = nn.CosineSimilarity(dim=1, eps=1e-6)
-  similarity_matrix = cos(continuousOutput.unsqueeze(0), embeddings)
+  if not isinstance(embeddings, NearestWordIndex):
+    embeddings = NearestWordIndex(embeddings)
 
-  word_index = torch.argmax(similarity_matrix)
+  word_index = embeddings.nearest(continuousOutput)
 
   closestNeighbour = idx2word[str(word_index.item())]
   return closestNeighbour, word_index
@@ -23,13 +27,18 @@ def findClosestWord(continuousOutput, embeddings, idx2word):
 
 # predEmbeddings (batch x length Longest caption x embed_dim)
 def generatePredictedCaptions(predEmbeddings, decode_lengths, embeddings, idx2word):
+  # Nearest words of the whole batch in a single lookup
+  if not isinstance(embeddings, NearestWordIndex):
+    embeddings = NearestWordIndex(embeddings)
+  word_indexes = embeddings.nearest(predEmbeddings.data).tolist()
+
   batch_size = predEmbeddings.shape[0]
   captions = []
   for captionNr in range(batch_size):
-    caption, _ = findClosestWord(predEmbeddings[captionNr, 0, :].data, embeddings, idx2word) # First wo$
+    caption = idx2word[str(word_indexes[captionNr][0])] # First word
 
-    for predictedWordEmbedding in predEmbeddings[captionNr,1:decode_lengths[captionNr], :]:
-      word, _ = findClosestWord(predictedWordEmbedding.data, embeddings, idx2word)
+    for word_index in word_indexes[captionNr][1:decode_lengths[captionNr]]:
+      word = idx2word[str(word_index)]
       if word == '<eoc>':
           break
       if word == '.':
@@ -40,4 +49,3 @@ def generatePredictedCaptions(predEmbeddings, decode_lengths, embeddings, idx2wo
 
   return captions
 
-
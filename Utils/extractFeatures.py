@@ -0,0 +1,35 @@
+import sys
+sys.path.append('../Utils/')
+
+from setupEnvironment import *
+from argParser import *
+
+
+def main():
+    """
+    Build the feature stores of the splits used by the run type set in the config file (Testing: test split,
+    Training: train and val splits) with the encoder of the checkpoint / classifier checkpoint.
+    """
+    argParser = get_args()
+
+    print(argParser)
+
+    modelInfo = None
+    classifierInfo = None
+
+    if (argParser.checkpoint is not None):
+        modelInfo = torch.load(argParser.checkpoint)
+
+    if (argParser.use_classifier_encoder) and modelInfo is None:
+        classifierInfo = torch.load(argParser.classifier_checkpoint)
+
+    encoder = setupEncoder(argParser, modelInfo, classifierInfo)
+
+    argParser.use_feature_store = True
+    argParser.fine_tune_encoder = False
+
+    setupDataLoaders(argParser, encoder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import sys
+sys.path.append('../Utils/')
+
+from argParser import *
+from generalUtilities import *
+from imageShards import *
+
+
+def main():
+    """
+    Decode, resize and write into uint8 shards the images of the splits used by the run type set in the config
+    file (Testing: test split, Training: train and val splits), for the splits with a shards path.
+    """
+    argParser = get_args()
+
+    if (argParser.runType == "Testing"):
+        splits = [(argParser.testImgsPath, argParser.testImgsManifestPath, argParser.testImgsShardsPath)]
+    elif (argParser.runType == "Training"):
+        splits = [(argParser.trainImgsPath, argParser.trainImgsManifestPath, argParser.trainImgsShardsPath),
+                  (argParser.valImgsPath, argParser.valImgsManifestPath, argParser.valImgsShardsPath)]
+
+    for imgsPath, manifestPath, shardsPath in splits:
+        if not shardsPath:
+            continue
+        imgPaths, studies = loadImageManifest(imgsPath, manifestPath)
+        buildImageShards(imgPaths, studies, shardsPath, argParser.image_size, argParser.image_shard_size,
+                         argParser.preprocessing_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import torch
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+from tqdm import tqdm
+
+from imageShards import ImageShards
+
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+FEATURES_FILE = 'features.npy'
+STUDIES_FILE = 'studies.npy'
+META_FILE = 'meta.json'
+
+
+def useFeatureStore(args):
+  """
+    Decide if the decoders should be fed from the offline feature store. This is only possible when
+    the encoder weights are frozen: while testing or while training without fine tuning the encoder.
+    :param args: Argument Parser object with definitions set in a specified config file
+  """
+  return args.use_feature_store and (args.runType == "Testing" or not args.fine_tune_encoder)
+
+
+def imageSource(imgsPath, transform=None, shardsPath=None):
+  """
+    Describe the images the encoder is run on: the image shards and the size of their images, or the image
+    directory and the transform of the decoded images
+    :param imgsPath: path to the images directory
+    :param transform: transform applied to the decoded images
+    :param shardsPath: path to the image shards, if the images are read from them
+  """
+  if shardsPath:
+    return 'shards:' + os.path.abspath(shardsPath) + ':image_size=' + str(ImageShards(shardsPath).image_size)
+  return 'images:' + os.path.abspath(imgsPath) + ':' + repr(transform)
+
+
+def encoderFingerprint(encoder, encoder_name, source=''):
+  """
+    Compute an identifier of the encoder architecture and weights and of the images it is run on. Stores are
+    keyed by it, so that changing the encoder name, loading another checkpoint or reading the images from
+    other shards, at another size, leads to a different store.
+    :param encoder: encoder model
+    :param encoder_name: name of the pre trained encoder model used
+    :param source: description of the images, given by imageSource
+  """
+  fingerprint = hashlib.sha1()
+  fingerprint.update(type(encoder).__name__.encode())
+  fingerprint.update(str(encoder_name).encode())
+  fingerprint.update(source.encode())
+  fingerprint.update(str(getattr(encoder, 'network_name', '')).encode())
+  for name, tensor in encoder.state_dict().items():
+    fingerprint.update(name.encode())
+    fingerprint.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+  return fingerprint.hexdigest()[:16]
+
+
+def getFeatureStorePath(args, split, fingerprint):
+  """
+    Path of the store with the features of a split for a given encoder
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param split: Train / Val / Test
+    :param fingerprint: encoder fingerprint
+  """
+  return os.path.join(args.feature_store_path, split + '_' + fingerprint)
+
+
+def isFeatureStoreValid(storePath, fingerprint):
+  """
+    Check if a complete store, created with the encoder with this fingerprint, exists in the path
+    :param storePath: path to the store directory
+    :param fingerprint: encoder fingerprint
+  """
+  metaPath = os.path.join(storePath, META_FILE)
+  if not os.path.isfile(metaPath):
+    return False
+  with open(metaPath) as json_file:
+    meta = json.load(json_file)
+  return meta.get('fingerprint') == fingerprint
+
+
+def buildFeatureStore(args, encoder, loader, storePath, fingerprint, source=''):
+  """
+    Run the encoder over every image of the loader and write the encoded images, keyed by study, in a
+    memory mapped array of shape (nr_studies, enc_image_size, enc_image_size, encoder_dim)
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model
+    :param loader: data loader returning images, captions, caption lengths and studies
+    :param storePath: path to the store directory
+    :param fingerprint: encoder fingerprint
+    :param source: description of the images, given by imageSource
+  """
+  dtype = np.float16 if args.feature_store_fp16 else np.float32
+
+  # Write to a temporary directory and move it in place when complete
+  tmpPath = storePath + '.tmp'
+  if os.path.isdir(tmpPath):
+    shutil.rmtree(tmpPath)
+  os.makedirs(tmpPath)
+
+  nr_studies = len(loader.dataset)
+  features = None
+  studies = []
+  row = 0
+
+  was_training = encoder.training
+  encoder.eval()
+
+  with torch.no_grad():
+    for imgs, _, _, batch_studies in tqdm(loader, desc="Extracting features to " + storePath):
+      imgs = imgs.to(device)
+      if (args.use_classifier_encoder):
+        encoder_out, _ = encoder(imgs)
+      else:
+        encoder_out = encoder(imgs)
+
+      encoder_out = encoder_out.cpu().numpy().astype(dtype)
+
+      if features is None:
+        features = np.lib.format.open_memmap(os.path.join(tmpPath, FEATURES_FILE), mode='w+', dtype=dtype,
+                                             shape=(nr_studies,) + encoder_out.shape[1:])
+
+      batch_size = encoder_out.shape[0]
+      features[row:row + batch_size] = encoder_out
+      studies.extend(batch_studies)
+      row += batch_size
+
+  encoder.train(was_training)
+
+  features.flush()
+  del features
+  np.save(os.path.join(tmpPath, STUDIES_FILE), np.array(studies))
+
+  # The meta file marks the store as complete
+  with open(os.path.join(tmpPath, META_FILE), 'w') as json_file:
+    json.dump({'fingerprint': fingerprint,
+               'encoder': type(encoder).__name__,
+               'encoder_name': args.encoder_name,
+               'image_source': source,
+               'dtype': np.dtype(dtype).name,
+               'nr_studies': row}, json_file)
+
+  if os.path.isdir(storePath):
+    shutil.rmtree(storePath)
+  os.rename(tmpPath, storePath)
+
+
+def loadFeatureStore(storePath):
+  """
+    Open a store created by buildFeatureStore
+    :param storePath: path to the store directory
+    :return: memory mapped features, study of each row
+  """
+  features = np.load(os.path.join(storePath, FEATURES_FILE), mmap_mode='r')
+  studies = np.load(os.path.join(storePath, STUDIES_FILE))
+  return features, studies
+
+
+def encodeImages(args, encoder, imgs):
+  """
+    Get the encoded images of a batch. If the loaders read from the feature store the batch already holds
+    the encoded images and the encoder is skipped.
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model
+    :param imgs: batch of images or of stored features, already in the device
+    :return: encoded images (batch_size, enc_image_size, enc_image_size, encoder_dim)
+  """
+  if useFeatureStore(args):
+    return imgs.float()
+
+  if (args.use_classifier_encoder):
+    encoder_out, _ = encoder(imgs)
+  else:
+    encoder_out = encoder(imgs)
+  return encoder_out
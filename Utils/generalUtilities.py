@@ -1,5 +1,7 @@
 import torch
 import os
+import re
+import numpy as np
 
 def writeLossToFile(loss, path):
   """
@@ -58,6 +60,43 @@ def getFilesInDirectory(path):
   return files
 
 
+def buildImageManifest(path, manifestPath):
+  """
+    Walk the image directory once and save a manifest with the path, study id, image id and size in bytes
+    of every image, in the order given by getFilesInDirectory
+    :param path: Root path of the images.
+    :param manifestPath: path to the .npz manifest file
+  """
+  imgPaths = getFilesInDirectory(path)
+  studies = [int(re.findall(r"s\d{8}", imgPath)[0][1:]) for imgPath in imgPaths]
+  imageIds = [os.path.splitext(os.path.basename(imgPath))[0] for imgPath in imgPaths]
+  sizes = [os.path.getsize(imgPath) for imgPath in imgPaths]
+
+  with open(manifestPath, 'wb') as manifest:
+    np.savez(manifest, paths=np.array(imgPaths), studies=np.array(studies, dtype=np.int64),
+             imageIds=np.array(imageIds), sizes=np.array(sizes, dtype=np.int64))
+
+
+def loadImageManifest(path, manifestPath=None):
+  """
+    Get the paths and study ids of the images in a directory from its manifest, building the manifest
+    if it does not exist. Without manifest path the directory is walked.
+    :param path: Root path of the images.
+    :param manifestPath: path to the .npz manifest file
+    :return: array with the path of each image, array with the study id of each image
+  """
+  if not manifestPath:
+    imgPaths = getFilesInDirectory(path)
+    studies = [int(re.findall(r"s\d{8}", imgPath)[0][1:]) for imgPath in imgPaths]
+    return np.array(imgPaths), np.array(studies, dtype=np.int64)
+
+  if not os.path.isfile(manifestPath):
+    buildImageManifest(path, manifestPath)
+
+  with np.load(manifestPath) as manifest:
+    return manifest['paths'], manifest['studies']
+
+
 def decodeCaption(caption, idx2word):
     if len(caption) == 0:
         return 'empty'
@@ -90,6 +129,78 @@ def decodeReference(caption, idx2word, word2idx):
 
 
 
+class Detokenizer(object):
+    """
+    Turns batches of encoded captions into strings, with the same output as decodeCaption. The vocabulary is
+    kept as a list indexed by word index, and the special tokens and <eoc> truncation are handled with masks
+    over the whole batch. The decoded references are cached by study, as they are the same every epoch.
+    """
+
+    def __init__(self, idx2word, word2idx):
+        """
+        :param idx2word: hash table with index -> word correspondence
+        :param word2idx: hash table with word -> index correspondence
+        """
+        self.words = [idx2word[str(index)] for index in range(len(idx2word))]
+        # Words after the first one: '.' is attached to the previous word, the others follow a space
+        self.spacedWords = [word if word == '.' else ' ' + word for word in self.words]
+        self.eocIdx = word2idx['<eoc>']
+        self.specialTokens = torch.LongTensor([word2idx['<sos>'], word2idx['<eoc>'], word2idx['<pad>']])
+        self.referenceCache = {}
+
+    def decode(self, captions, removeSpecialTokens=False):
+        """
+        Decode a batch of captions. Each caption is cut before the first <eoc> after its first word.
+        :param captions: encoded captions, a tensor of dimension (batch_size, max_caption_length) or a list of lists
+            of word indexes
+        :param removeSpecialTokens: remove all the <sos>, <eoc> and <pad> tokens before decoding
+        :return: list with the decoded captions
+        """
+        if torch.is_tensor(captions):
+            captions = captions.cpu()
+            keep = torch.ones(captions.shape, dtype=torch.bool)
+        else:
+            lengths = torch.LongTensor([len(caption) for caption in captions])
+            captions = torch.nn.utils.rnn.pad_sequence([torch.LongTensor(caption) for caption in captions],
+                                                       batch_first=True, padding_value=self.eocIdx)
+            keep = torch.arange(captions.size(1)).unsqueeze(0) < lengths.unsqueeze(1)
+
+        if removeSpecialTokens:
+            keep &= ~torch.isin(captions, self.specialTokens)
+
+        # The first kept word of a caption is never treated as its end
+        eoc = (captions == self.eocIdx) & keep
+        eoc &= keep.long().cumsum(dim=1) > 1
+        keep &= eoc.long().cumsum(dim=1) == 0
+
+        decoded = []
+        for caption, captionKeep in zip(captions.tolist(), keep.tolist()):
+            caption = [index for index, kept in zip(caption, captionKeep) if kept]
+            if len(caption) == 0:
+                decoded.append('empty')
+            else:
+                decoded.append(self.words[caption[0]] + ''.join([self.spacedWords[index] for index in caption[1:]]))
+
+        return decoded
+
+    def decodeReferences(self, studies, captions):
+        """
+        Decode the references of a batch, without special tokens, decoding each study only the first time
+        :param studies: study ids of the batch
+        :param captions: encoded references, a tensor of dimension (batch_size, max_caption_length)
+        :return: list with the decoded references
+        """
+        studies = studies.tolist() if torch.is_tensor(studies) else list(studies)
+
+        missing = [row for row, study in enumerate(studies) if study not in self.referenceCache]
+        if missing:
+            for row, reference in zip(missing, self.decode(captions[missing], removeSpecialTokens=True)):
+                self.referenceCache[studies[row]] = reference
+
+        return [self.referenceCache[study] for study in studies]
+
+
+
 def unifyCaption(listCaption):
     unifiedCaption = ''
     for word in listCaption:
@@ -149,20 +260,16 @@ def save_references_and_predictions(references, predictions, modelName, mode):
 
 
 def reshape_target_labels(targets):
-    batch_size = targets.shape[0]
-    nr_labels = targets.shape[1]
-    reshaped = torch.zeros((batch_size, nr_labels *2), dtype=torch.float)
-    for i in range(batch_size):
-        #print(i)
-        for j in range(nr_labels):
-            #print(j)
-            if targets[i,j] == -1:
-                reshaped[i,j*2] = 0.5
-                reshaped[i,j*2+1] = 0.5
-            elif targets[i,j] == 1:
-                reshaped[i,j*2] = 1
-            elif targets[i,j] == 0:
-                reshaped[i,j*2+1] = 1
+    """
+    Expand each label into two soft target columns (positive, negative):
+    1 -> (1, 0), 0 -> (0, 1), -1 (uncertain) -> (0.5, 0.5), any other value (missing) -> (0, 0)
+    :param targets: labels, a tensor of dimension (batch_size, nr_labels)
+    :return: soft targets, a tensor of dimension (batch_size, nr_labels * 2)
+    """
+    uncertain = (targets == -1).float() * 0.5
+    reshaped = torch.empty((targets.shape[0], targets.shape[1] * 2), dtype=torch.float)
+    reshaped[:, 0::2] = (targets == 1).float() + uncertain
+    reshaped[:, 1::2] = (targets == 0).float() + uncertain
     return reshaped
 
 
@@ -0,0 +1,191 @@
+import numpy as np
+import json
+import os
+import torch
+
+
+SENTENCES_FILE = 'sentences.npy'
+SENTENCES_LENGTHS_FILE = 'sentencesLengths.npy'
+REPORT_LENGTHS_FILE = 'reportLengths.npy'
+STUDIES_FILE = 'studies.npy'
+
+
+def buildSentenceStore(sentences, sentencesLengths, reportLengths, storePath, padIdx):
+  """
+    Convert the sentence split reports of a split into a sentence store: the padded sentences of all studies
+    in an int32 array of dimension (studies, max report length, max sentence length), the length of each
+    sentence (studies, max report length), the length in sentences of each report and the sorted study ids
+    :param sentences: dictionary with study -> list of encoded sentences
+    :param sentencesLengths: dictionary with study -> list of sentence lengths
+    :param reportLengths: dictionary with study -> number of sentences of the report
+    :param storePath: path to the store directory
+    :param padIdx: index of the pad token
+  """
+  studies = sorted(reportLengths.keys(), key=int)
+
+  max_report_length = max(reportLengths[study] for study in studies)
+  max_sentence_length = max(len(sentence) for study in studies for sentence in sentences[study][:reportLengths[study]])
+
+  if not os.path.isdir(storePath):
+    os.makedirs(storePath)
+
+  storedSentences = np.lib.format.open_memmap(os.path.join(storePath, SENTENCES_FILE), mode='w+', dtype=np.int32,
+                                              shape=(len(studies), max_report_length, max_sentence_length))
+  storedSentences[:] = padIdx
+  storedSentencesLengths = np.zeros((len(studies), max_report_length), dtype=np.int32)
+
+  for n, study in enumerate(studies):
+    reportLength = reportLengths[study]
+    for row, sentence in enumerate(sentences[study][:reportLength]):
+      storedSentences[n, row, :len(sentence)] = sentence
+    storedSentencesLengths[n, :reportLength] = sentencesLengths[study][:reportLength]
+
+  storedSentences.flush()
+  del storedSentences
+
+  np.save(os.path.join(storePath, SENTENCES_LENGTHS_FILE), storedSentencesLengths)
+  np.save(os.path.join(storePath, REPORT_LENGTHS_FILE), np.array([reportLengths[study] for study in studies], dtype=np.int32))
+  np.save(os.path.join(storePath, STUDIES_FILE), np.array([int(study) for study in studies], dtype=np.int64))
+
+
+def buildSentenceStoreFromJson(word2idx_path, sentencesPath, sentencesLengthsPath, reportLengthsPath, storePath):
+  """
+    Build a sentence store from the json files with the sentences, sentence lengths and report lengths of a split
+  """
+  with open(word2idx_path) as json_file:
+    word2idx = json.load(json_file)
+
+  with open(reportLengthsPath) as json_file:
+    reportLengths = json.load(json_file)
+
+  with open(sentencesLengthsPath) as json_file:
+    sentencesLengths = json.load(json_file)
+
+  with open(sentencesPath) as json_file:
+    sentences = json.load(json_file)
+
+  buildSentenceStore(sentences, sentencesLengths, reportLengths, storePath, word2idx['<pad>'])
+
+
+def flattenReportSentences(sentences, sentencesLengths, reportLengths):
+  """
+    Sentences of all the reports of a batch, as read from a sentence store
+    :param sentences: padded sentences (batch_size, max report length, max sentence length)
+    :param sentencesLengths: sentence lengths (batch_size, max report length)
+    :param reportLengths: report lengths in sentences (batch_size)
+    :return: sentences of all the reports ordered by report then sentence, padded to the longest sentence length
+      (nr_sentences, max_sentence_length), sentence lengths (nr_sentences)
+  """
+  reportMask = torch.arange(sentences.size(1), device=sentences.device).unsqueeze(0) < reportLengths.unsqueeze(1)
+  sentencesLengths = sentencesLengths[reportMask]
+  sentences = sentences[reportMask][:, :sentencesLengths.max()]
+  return sentences, sentencesLengths
+
+
+class SentenceStore(object):
+  """
+    Read access to a sentence store built by buildSentenceStore. The arrays are memory mapped when first
+    accessed, so that each data loader worker opens its own maps.
+  """
+
+  def __init__(self, storePath):
+    self.storePath = storePath
+    self.sentences = None
+    self.sentencesLengths = None
+    self.reportLengths = None
+    self.studies = None
+
+  def open(self):
+    self.sentences = np.load(os.path.join(self.storePath, SENTENCES_FILE), mmap_mode='r')
+    self.sentencesLengths = np.load(os.path.join(self.storePath, SENTENCES_LENGTHS_FILE), mmap_mode='r')
+    self.reportLengths = np.load(os.path.join(self.storePath, REPORT_LENGTHS_FILE), mmap_mode='r')
+    self.studies = np.load(os.path.join(self.storePath, STUDIES_FILE), mmap_mode='r')
+
+  def getIndex(self, study):
+    """
+      Position of a study in the store
+      :param study: study id (string or int)
+    """
+    if self.studies is None:
+      self.open()
+    idx = int(np.searchsorted(self.studies, int(study)))
+    if idx == len(self.studies) or self.studies[idx] != int(study):
+      raise KeyError(study)
+    return idx
+
+  def getReport(self, study):
+    """
+      Sentences of the report of a study
+      :param study: study id (string or int)
+      :return: padded sentences (max report length, max sentence length), sentence lengths (max report length)
+        and report length in sentences, as int32 arrays
+    """
+    idx = self.getIndex(study)
+    return np.array(self.sentences[idx]), np.array(self.sentencesLengths[idx]), np.int32(self.reportLengths[idx])
+
+
+class HierarchicalSentences(object):
+  """
+    Sentence split reports of a split, used as targets of the hierarchical models. The json files are read
+    when first accessed, and each report is kept as a (report length, max sentence length) LongTensor with
+    its padded sentences along with the length of each of them.
+  """
+
+  def __init__(self, sentencesPath, sentencesLengthsPath, reportLengthsPath, padIdx):
+    """
+      :param sentencesPath: path to the json with study -> list of encoded sentences
+      :param sentencesLengthsPath: path to the json with study -> list of sentence lengths
+      :param reportLengthsPath: path to the json with study -> number of sentences of the report
+      :param padIdx: index of the pad token
+    """
+    self.sentencesPath = sentencesPath
+    self.sentencesLengthsPath = sentencesLengthsPath
+    self.reportLengthsPath = reportLengthsPath
+    self.padIdx = padIdx
+    self.sentences = None
+    self.sentencesLengths = None
+
+  def load(self):
+    with open(self.reportLengthsPath) as json_file:
+      reportLengths = json.load(json_file)
+
+    with open(self.sentencesLengthsPath) as json_file:
+      sentencesLengths = json.load(json_file)
+
+    with open(self.sentencesPath) as json_file:
+      sentences = json.load(json_file)
+
+    self.sentences = {}
+    self.sentencesLengths = {}
+    for study, reportLength in reportLengths.items():
+      reportSentences = sentences[study][:reportLength]
+      width = max([len(sentence) for sentence in reportSentences] + [0])
+      padded = torch.full((len(reportSentences), width), self.padIdx, dtype=torch.long)
+      for row, sentence in enumerate(reportSentences):
+        padded[row, :len(sentence)] = torch.LongTensor(sentence)
+      self.sentences[study] = padded
+      self.sentencesLengths[study] = torch.LongTensor(sentencesLengths[study][:reportLength])
+
+  def getBatch(self, studies):
+    """
+      Sentences of the reports of a batch of studies
+      :param studies: study ids
+      :return: sentences of all the reports ordered by report then sentence, padded to the longest sentence length
+        (nr_sentences, max_sentence_length), sentence lengths (nr_sentences), report lengths in sentences (batch_size)
+    """
+    if self.sentences is None:
+      self.load()
+
+    reports = [self.sentences[study] for study in studies]
+    report_lengths = torch.LongTensor([report.size(0) for report in reports])
+    sentences_lengths = torch.cat([self.sentencesLengths[study] for study in studies])
+
+    max_sentence_length = sentences_lengths.max().item()
+    sentences = torch.full((sentences_lengths.size(0), max_sentence_length), self.padIdx, dtype=torch.long)
+    row = 0
+    for report in reports:
+      width = min(report.size(1), max_sentence_length)
+      sentences[row:row + report.size(0), :width] = report[:, :width]
+      row += report.size(0)
+
+    return sentences, sentences_lengths, report_lengths
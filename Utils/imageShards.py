@@ -0,0 +1,99 @@
+import numpy as np
+import json
+import os
+from multiprocessing import Pool
+from PIL import Image
+from tqdm import tqdm
+
+
+SHARD_FILE = 'shard_%05d.npy'
+STUDIES_FILE = 'studies.npy'
+META_FILE = 'meta.json'
+
+
+def decodeImage(imgPath, image_size):
+  """
+    Decode a grayscale image and resize it to image_size x image_size
+    :param imgPath: path to the image
+    :param image_size: side of the resized image (0: keep the original size)
+    :return: uint8 array of dimension (1, image_size, image_size)
+  """
+  image = Image.open(imgPath).convert('L')
+  if image_size:
+    image = image.resize((image_size, image_size), Image.BILINEAR)
+  return np.asarray(image)[np.newaxis]
+
+
+def _decodeImage(job):
+  return decodeImage(*job)
+
+
+def buildImageShards(imgPaths, studies, shardsPath, image_size, shard_size=4096, num_workers=8):
+  """
+    Decode and resize the images once and write them, in the given order, into uint8 memory mapped shards
+    of shape (shard_size, 1, image_size, image_size)
+    :param imgPaths: path of each image
+    :param studies: study id of each image
+    :param shardsPath: path to the shards directory
+    :param image_size: side of the resized images (0: keep the original size, which must be the same for all)
+    :param shard_size: number of images per shard
+    :param num_workers: number of processes decoding images
+  """
+  if not os.path.isdir(shardsPath):
+    os.makedirs(shardsPath)
+
+  nr_images = len(imgPaths)
+  jobs = [(str(imgPath), image_size) for imgPath in imgPaths]
+
+  with Pool(num_workers) as pool:
+    images = pool.imap(_decodeImage, jobs, chunksize=64)
+
+    for start in tqdm(range(0, nr_images, shard_size), desc="Writing image shards to " + shardsPath):
+      nr_shard_images = min(shard_size, nr_images - start)
+      shard = None
+      for row in range(nr_shard_images):
+        image = next(images)
+        if shard is None:
+          shard = np.lib.format.open_memmap(os.path.join(shardsPath, SHARD_FILE % (start // shard_size)), mode='w+',
+                                            dtype=np.uint8, shape=(nr_shard_images,) + image.shape)
+        shard[row] = image
+      shard.flush()
+      del shard
+
+  np.save(os.path.join(shardsPath, STUDIES_FILE), np.array(studies, dtype=np.int64))
+
+  # The meta file marks the shards as complete
+  with open(os.path.join(shardsPath, META_FILE), 'w') as json_file:
+    json.dump({'nr_images': nr_images, 'shard_size': shard_size, 'image_size': image_size}, json_file)
+
+
+class ImageShards(object):
+  """
+    Read access to the shards built by buildImageShards. The shards are memory mapped when first accessed,
+    so that each data loader worker opens its own maps.
+  """
+
+  def __init__(self, shardsPath):
+    self.shardsPath = shardsPath
+    with open(os.path.join(shardsPath, META_FILE)) as json_file:
+      meta = json.load(json_file)
+    self.nr_images = meta['nr_images']
+    self.shard_size = meta['shard_size']
+    self.image_size = meta['image_size']
+    self.studies = np.load(os.path.join(shardsPath, STUDIES_FILE))
+    self.shards = None
+
+  def __len__(self):
+    return self.nr_images
+
+  def getImage(self, idx):
+    """
+      Image idx, as a view of its shard
+      :return: uint8 array of dimension (1, image_size, image_size)
+    """
+    if self.shards is None:
+      nr_shards = (self.nr_images + self.shard_size - 1) // self.shard_size
+      self.shards = [np.load(os.path.join(self.shardsPath, SHARD_FILE % shard), mmap_mode='r')
+                     for shard in range(nr_shards)]
+    return self.shards[idx // self.shard_size][idx % self.shard_size]
+
@@ -0,0 +1,259 @@
+import math
+import os
+import multiprocessing
+from collections import defaultdict
+
+
+NGRAM_ORDER = 4
+ROUGE_BETA = 1.2
+CIDER_SIGMA = 6.0
+
+# Statistics of the references being scored, set in each pool worker by its initializer
+_referenceStatistics = None
+
+
+def precook(sentence, n=NGRAM_ORDER):
+  """
+    Count the n-grams of a sentence, split on whitespace as in pycocoevalcap
+    :param sentence: sentence string
+    :param n: maximum n-gram order
+    :return: number of words, dictionary with n-gram tuple -> count
+  """
+  words = sentence.split()
+  counts = defaultdict(int)
+  for k in range(1, n + 1):
+    for i in range(len(words) - k + 1):
+      counts[tuple(words[i:i + k])] += 1
+  return len(words), counts
+
+
+def lcsLength(a, b):
+  """
+    Length of the longest common subsequence of two token lists
+  """
+  if len(a) < len(b):
+    a, b = b, a
+  previous = [0] * (len(b) + 1)
+  for tokenA in a:
+    current = [0]
+    for j, tokenB in enumerate(b):
+      if tokenA == tokenB:
+        current.append(previous[j] + 1)
+      else:
+        current.append(max(previous[j + 1], current[j]))
+    previous = current
+  return previous[-1]
+
+
+def ciderVector(counts, documentFrequency, logNrImages):
+  """
+    Tf-idf vector of the n-gram counts of a sentence, one dictionary and norm per n-gram order, and the length
+    used by the CIDEr-D length penalty (which pycocoevalcap takes as the number of bigrams)
+  """
+  vec = [{} for _ in range(NGRAM_ORDER)]
+  norm = [0.0] * NGRAM_ORDER
+  length = 0
+  for ngram, termFrequency in counts.items():
+    n = len(ngram) - 1
+    df = math.log(max(1.0, documentFrequency.get(ngram, 0.0)))
+    vec[n][ngram] = float(termFrequency) * (logNrImages - df)
+    norm[n] += vec[n][ngram] ** 2
+    if n == 1:
+      length += termFrequency
+  return vec, [math.sqrt(value) for value in norm], length
+
+
+class ReferenceStatistics(object):
+  """
+    Statistics of the references of a split needed to score hypotheses against them: BLEU reference lengths and
+    clipped n-gram counts, ROUGE-L tokens and CIDEr document frequencies and tf-idf vectors. They only depend on
+    the references, so they are computed once per split.
+  """
+
+  def __init__(self, references):
+    """
+      :param references: list with the references of each image, each a list of sentence strings
+    """
+    self.nrImages = len(references)
+
+    self.bleu = []
+    self.rouge = []
+    cooked = []
+    for refs in references:
+      reflens = []
+      maxCounts = {}
+      refCounts = []
+      for ref in refs:
+        length, counts = precook(ref)
+        reflens.append(length)
+        refCounts.append(counts)
+        for ngram, count in counts.items():
+          maxCounts[ngram] = max(maxCounts.get(ngram, 0), count)
+      self.bleu.append((reflens, maxCounts))
+      self.rouge.append([ref.split(" ") for ref in refs])
+      cooked.append(refCounts)
+
+    # Number of images with the n-gram in at least one of their references
+    self.documentFrequency = defaultdict(float)
+    for refCounts in cooked:
+      for ngram in set(ngram for counts in refCounts for ngram in counts):
+        self.documentFrequency[ngram] += 1
+    self.documentFrequency = dict(self.documentFrequency)
+
+    self.logNrImages = math.log(float(self.nrImages))
+    self.cider = [[ciderVector(counts, self.documentFrequency, self.logNrImages) for counts in refCounts]
+                  for refCounts in cooked]
+
+  def score(self, idx, hypothesis):
+    """
+      Statistics of a hypothesis against the references of its image
+      :param idx: image index
+      :param hypothesis: hypothesis string
+      :return: BLEU counts (testlen, reflen, guess, correct), ROUGE-L score, CIDEr score
+    """
+    testlen, counts = precook(hypothesis)
+
+    # BLEU, with the closest reference length
+    reflens, maxCounts = self.bleu[idx]
+    reflen = min((abs(length - testlen), length) for length in reflens)[1]
+    guess = [max(0, testlen - k + 1) for k in range(1, NGRAM_ORDER + 1)]
+    correct = [0] * NGRAM_ORDER
+    for ngram, count in counts.items():
+      correct[len(ngram) - 1] += min(maxCounts.get(ngram, 0), count)
+
+    # ROUGE-L, best precision and recall over the references
+    candidate = hypothesis.split(" ")
+    precisions = []
+    recalls = []
+    for reference in self.rouge[idx]:
+      lcs = lcsLength(reference, candidate)
+      precisions.append(lcs / float(len(candidate)))
+      recalls.append(lcs / float(len(reference)))
+    precision = max(precisions)
+    recall = max(recalls)
+    if precision != 0 and recall != 0:
+      rouge = ((1 + ROUGE_BETA ** 2) * precision * recall) / float(recall + ROUGE_BETA ** 2 * precision)
+    else:
+      rouge = 0.0
+
+    # CIDEr(-D), mean of the n-gram orders of the mean clipped cosine similarity with the references, with a
+    # gaussian penalty on the length difference
+    vec, norm, length = ciderVector(counts, self.documentFrequency, self.logNrImages)
+    similarity = [0.0] * NGRAM_ORDER
+    for vecRef, normRef, lengthRef in self.cider[idx]:
+      penalty = math.exp(-(float(length - lengthRef) ** 2) / (2 * CIDER_SIGMA ** 2))
+      for n in range(NGRAM_ORDER):
+        value = 0.0
+        for ngram, weight in vec[n].items():
+          refWeight = vecRef[n].get(ngram, 0.0)
+          value += min(weight, refWeight) * refWeight
+        if norm[n] != 0 and normRef[n] != 0:
+          value /= (norm[n] * normRef[n])
+        similarity[n] += value * penalty
+    cider = sum(similarity) / NGRAM_ORDER / len(self.cider[idx]) * 10.0
+
+    return (testlen, reflen, guess, correct), rouge, cider
+
+
+def _initWorker(referenceStatistics):
+  global _referenceStatistics
+  _referenceStatistics = referenceStatistics
+
+
+def _scoreChunk(chunk):
+  start, hypotheses = chunk
+  return [_referenceStatistics.score(start + i, hypothesis) for i, hypothesis in enumerate(hypotheses)]
+
+
+def corpusBleu(bleuCounts):
+  """
+    Corpus BLEU-1..4 from the per hypothesis counts, as pycocoevalcap's BleuScorer with the closest reference length
+  """
+  small = 1e-9
+  tiny = 1e-15
+
+  testlen = sum(counts[0] for counts in bleuCounts)
+  reflen = sum(counts[1] for counts in bleuCounts)
+  guess = [sum(counts[2][k] for counts in bleuCounts) for k in range(NGRAM_ORDER)]
+  correct = [sum(counts[3][k] for counts in bleuCounts) for k in range(NGRAM_ORDER)]
+
+  bleus = []
+  bleu = 1.
+  for k in range(NGRAM_ORDER):
+    bleu *= float(correct[k] + tiny) / (guess[k] + small)
+    bleus.append(bleu ** (1. / (k + 1)))
+
+  ratio = (testlen + tiny) / (reflen + small)
+  if ratio < 1:
+    bleus = [value * math.exp(1 - 1 / ratio) for value in bleus]
+  return bleus
+
+
+class NLGMetrics(object):
+  """
+    In process BLEU-1..4, ROUGE-L and CIDEr, with the same definitions and inputs as NLGEval.compute_metrics
+    (pycocoevalcap scorers on whitespace split sentences, CIDEr being its CIDEr-D). The statistics of the last
+    references are cached, so scoring the same split every epoch only processes the hypotheses, which are
+    scored by a pool of worker processes.
+  """
+
+  def __init__(self, nrWorkers=4, chunksPerWorker=4):
+    """
+      :param nrWorkers: number of worker processes, 0 or 1 to score in the calling process
+      :param chunksPerWorker: number of chunks of hypotheses sent to each worker
+    """
+    self.nrWorkers = min(nrWorkers, os.cpu_count() or 1)
+    self.chunksPerWorker = chunksPerWorker
+    self.referencesKey = None
+    self.referenceStatistics = None
+    self.pool = None
+
+  def setReferences(self, references):
+    """
+      Compute the statistics of the references of a split, unless they are the cached ones
+      :param references: list with the references of each image, each a list of sentence strings
+    """
+    key = tuple(tuple(refs) for refs in references)
+    if key == self.referencesKey:
+      return
+
+    self.close()
+    self.referencesKey = key
+    self.referenceStatistics = ReferenceStatistics(references)
+    if self.nrWorkers > 1:
+      self.pool = multiprocessing.Pool(self.nrWorkers, initializer=_initWorker, initargs=(self.referenceStatistics,))
+
+  def compute_metrics(self, ref_list, hyp_list):
+    """
+      :param ref_list: list of reference lists, ref_list[j][i] is the j-th reference of the i-th image
+      :param hyp_list: list with the hypothesis of each image
+      :return: dictionary with Bleu_1..4, ROUGE_L and CIDEr
+    """
+    if len(hyp_list) == 0:
+      raise ValueError("No hypotheses to compute the metrics of")
+
+    references = [[ref.strip() for ref in refs] for refs in zip(*ref_list)]
+    hypotheses = [hyp.strip() for hyp in hyp_list]
+    assert len(references) == len(hypotheses)
+
+    self.setReferences(references)
+
+    if self.pool is not None:
+      chunkSize = max(1, int(math.ceil(len(hypotheses) / float(self.nrWorkers * self.chunksPerWorker))))
+      chunks = [(start, hypotheses[start:start + chunkSize]) for start in range(0, len(hypotheses), chunkSize)]
+      scores = [score for chunkScores in self.pool.map(_scoreChunk, chunks) for score in chunkScores]
+    else:
+      scores = [self.referenceStatistics.score(idx, hypothesis) for idx, hypothesis in enumerate(hypotheses)]
+
+    metrics = {}
+    for k, bleu in enumerate(corpusBleu([score[0] for score in scores])):
+      metrics['Bleu_' + str(k + 1)] = bleu
+    metrics['ROUGE_L'] = sum(score[1] for score in scores) / len(scores)
+    metrics['CIDEr'] = sum(score[2] for score in scores) / len(scores)
+    return metrics
+
+  def close(self):
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
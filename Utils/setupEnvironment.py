@@ -9,14 +9,18 @@ from Encoder import *
 from RefactoredEncoder import *
 from ClassifyingEncoder import *
 from Attention import *
+from NearestWordIndex import *
 from HierarchicalSoftmaxDecoder import *
 from SoftmaxDecoder import *
 from ContinuousDecoder import *
 from ImgContinuousDecoder import *
 from XRayDataset import *
-#from HierarchicalXRayDataset import *
+from FeatureXRayDataset import *
+from BucketBatchSampler import *
+from HierarchicalXRayDataset import *
 from TrainingEnvironment import *
 from losses import *
+from featureStore import *
 
 
 from datetime import datetime
@@ -39,13 +43,12 @@ import argparse
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
-def setupEncoderDecoder(args, model_checkpoint=None, classifying_encoder_checkpoint=None):
-  # Load embeddings from disk
-  word_map, embeddings, vocab_size, embed_dim = loadEmbeddingsFromDisk(args.embeddingsPath, args.normalizeEmb)
-  embeddings = embeddings.to(device)
-
-  idx2word, word2idx = loadWordIndexDicts(args)
-
+def setupEncoder(args, model_checkpoint=None, classifying_encoder_checkpoint=None):
+  """
+    Create the encoder and load its weights from the model checkpoint or, for a classifier encoder without
+    model checkpoint, from the classifier checkpoint
+    :param args: Argument Parser object with definitions set in a specified config file
+  """
   if (args.use_classifier_encoder):
       encoder = ClassifyingEncoder(args.encoder_name)
       print("Created Classifier encoder")
@@ -62,6 +65,23 @@ def setupEncoderDecoder(args, model_checkpoint=None, classifying_encoder_checkpo
           print("Created refactored encoder")
           encoder = RefactoredEncoder(args.encoder_name)
 
+  # Load trained model if checkpoint exists
+  if (model_checkpoint is not None):
+    print("Loaded encoder from the BEST checkpoint")
+    encoder.load_state_dict(model_checkpoint['encoder'])
+
+  return encoder.to(device)
+
+
+def setupEncoderDecoder(args, model_checkpoint=None, classifying_encoder_checkpoint=None):
+  # Load embeddings from disk
+  word_map, embeddings, vocab_size, embed_dim = loadEmbeddingsFromDisk(args.embeddingsPath, args.normalizeEmb)
+  embeddings = embeddings.to(device)
+
+  idx2word, word2idx = loadWordIndexDicts(args)
+
+  encoder = setupEncoder(args, model_checkpoint, classifying_encoder_checkpoint)
+
 
   print(embed_dim)
   #print(encoder.dim)
@@ -138,15 +158,11 @@ def setupEncoderDecoder(args, model_checkpoint=None, classifying_encoder_checkpo
   # Load trained model if checkpoint exists
   if (model_checkpoint is not None):
     decoder.load_state_dict(model_checkpoint['decoder'])
-    #if (not args.use_classifier_encoder):
-    print("Loaded encoder from the BEST checkpoint")
-    encoder.load_state_dict(model_checkpoint['encoder'])
 
 
 
   # Move to GPU, if available
   decoder = decoder.to(device)
-  encoder = encoder.to(device)
 
   if (args.runType == "Testing"):
     decoder.eval()
@@ -184,9 +200,19 @@ def setupSchedulers(encoder_optimizer, decoder_optimizer, args):
 
 
 
-def setupCriterion(loss):
+def setupCriterion(loss, args=None, embeddings=None, reduction='mean'):
+  """
+    Create the loss layer
+    :param loss: name of the loss
+    :param args: Argument Parser object with definitions set in a specified config file, required by TripleMarginLoss
+    :param embeddings: embeddings matrix of the decoder, required by the MINS mode of TripleMarginLoss
+    :param reduction: 'mean', or 'none' for per word losses, which only CrossEntropy supports
+  """
+  if reduction != 'mean' and loss != 'CrossEntropy':
+    raise ValueError("The " + str(loss) + " loss does not support the '" + str(reduction) + "' reduction, only CrossEntropy does")
+
   if (loss == 'CrossEntropy'):
-    criterion = nn.CrossEntropyLoss().to(device)
+    criterion = nn.CrossEntropyLoss(reduction=reduction).to(device)
 
   elif (loss == 'CosineSimilarity'):
     criterion = CosineEmbedLoss()
@@ -201,7 +227,8 @@ def setupCriterion(loss):
     criterion = SmoothL1LossWordAndSentenceAndImage().to(device)
 
   elif (loss == 'TripleMarginLoss'):
-    criterion = SyntheticTripletLoss(args.triplet_loss_margin, args.triplet_loss_mode)
+    criterion = SyntheticTripletLoss(args.triplet_loss_margin, args.triplet_loss_mode, embeddings,
+                                     args.triplet_loss_negatives)
 
   return criterion
 
@@ -209,42 +236,177 @@ def setupCriterion(loss):
 
 
 
-def setupDataLoaders(args):
+def setupDataLoaders(args, encoder=None):
   """
     Create the necessary data loaders according to run type: Training/Testing
     :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model, required to read the encoded images from the feature store
   """
 
-  # Transforms required for models pre-trained o ImageNet
-  transform = transforms.Compose([
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225])
-    ])
+  transform = imageTransform()
+
+  if useFeatureStore(args):
+    return setupFeatureDataLoaders(args, encoder, transform)
 
   # Create MIMIC dataset loaders
   if (args.runType == "Testing"):
     testLoader = DataLoader(XRayDataset(args.word2idxPath, args.encodedTestCaptionsPath,
-      args.encodedTestCaptionsLengthsPath, args.testImgsPath, transform), batch_size=args.batch_size, shuffle=True)
+      args.encodedTestCaptionsLengthsPath, args.testImgsPath, transform, captionStorePath=args.testCaptionStorePath,
+      manifestPath=args.testImgsManifestPath,
+      shardsPath=args.testImgsShardsPath),
+      batch_size=args.batch_size, shuffle=True, **getLoaderOptions(args))
 
     return testLoader, None
 
   elif (args.runType == "Training"):
-#    if "Hierarchical" in args.model:
-#        trainLoader = DataLoader(HierarchicalXRayDataset(args.word2idxPath,  args.encodedTrainCaptionsPath,
-#           args.encodedTrainCaptionsLengthsPath, args.trainImgsPath, transform), batch_size=args.batch_size, shuffle=True)
-#        valLoader = DataLoader(HierarchicalXRayDataset(args.word2idxPath,  args.encodedValCaptionsPath,
-#           args.encodedValCaptionsLengthsPath, args.valImgsPath, transform, training=False), batch_size=1, shuffle=True)
-
- #   else:
-    trainLoader = DataLoader(XRayDataset(args.word2idxPath, args.encodedTrainCaptionsPath,
-         args.encodedTrainCaptionsLengthsPath, args.trainImgsPath, transform), batch_size=args.batch_size, shuffle=True)
-    valLoader = DataLoader(XRayDataset(args.word2idxPath, args.encodedValCaptionsPath,
-          args.encodedValCaptionsLengthsPath, args.valImgsPath, transform), batch_size=1, shuffle=True)
+    # The hierarchical models read their sentence split training reports from the sentence store
+    if "Hierarchical" in args.model and args.trainSentenceStorePath:
+      trainLoader = setupTrainLoader(args, HierarchicalXRayDataset(args.word2idxPath, args.encodedTrainCaptionsPath,
+           args.encodedTrainCaptionsLengthsPath, args.trainImgsPath, args.trainSentenceStorePath, transform,
+           padCaptions=not usePadCollate(args), captionStorePath=args.trainCaptionStorePath,
+           manifestPath=args.trainImgsManifestPath, shardsPath=args.trainImgsShardsPath))
+    else:
+      trainLoader = setupTrainLoader(args, XRayDataset(args.word2idxPath, args.encodedTrainCaptionsPath,
+           args.encodedTrainCaptionsLengthsPath, args.trainImgsPath, transform, padCaptions=not usePadCollate(args),
+           captionStorePath=args.trainCaptionStorePath, manifestPath=args.trainImgsManifestPath,
+           shardsPath=args.trainImgsShardsPath))
+    valLoader = setupValLoader(args, encoder)
 
     return trainLoader, valLoader
 
 
+def imageTransform():
+  """
+    Single channel uint8 images; the encoders replicate the channel and apply the
+    normalization required for models pre-trained on ImageNet
+  """
+  return transforms.Compose([
+    transforms.Grayscale(num_output_channels=1),
+    transforms.PILToTensor()
+    ])
+
+
+def setupValLoader(args, encoder=None):
+  """
+    Create only the validation data loader, e.g. for a validation running in another process
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model, required to read the encoded images from the feature store
+  """
+  transform = imageTransform()
+
+  if useFeatureStore(args):
+    if encoder is None:
+      raise ValueError("The encoder is required to use the feature store")
+
+    valStorePath = setupFeatureStore(args, encoder, "Val", args.encodedValCaptionsPath,
+          args.encodedValCaptionsLengthsPath, args.valImgsPath, transform, args.valCaptionStorePath, args.valImgsManifestPath,
+          args.valImgsShardsPath)
+    return DataLoader(FeatureXRayDataset(args.word2idxPath, args.encodedValCaptionsPath,
+          args.encodedValCaptionsLengthsPath, valStorePath, captionStorePath=args.valCaptionStorePath),
+          batch_size=args.eval_batch_size, shuffle=True, **getLoaderOptions(args))
+
+  return DataLoader(XRayDataset(args.word2idxPath, args.encodedValCaptionsPath,
+          args.encodedValCaptionsLengthsPath, args.valImgsPath, transform, captionStorePath=args.valCaptionStorePath,
+          manifestPath=args.valImgsManifestPath,
+          shardsPath=args.valImgsShardsPath),
+          batch_size=args.eval_batch_size, shuffle=True, **getLoaderOptions(args))
+
+
+def getLoaderOptions(args):
+  """
+    Worker, pinning and prefetch options of the data loaders
+    :param args: Argument Parser object with definitions set in a specified config file
+  """
+  options = {'num_workers': args.num_workers, 'pin_memory': args.pin_memory}
+  # Persistent workers and prefetching only exist with worker processes
+  if args.num_workers > 0:
+    options['persistent_workers'] = args.persistent_workers
+    options['prefetch_factor'] = args.prefetch_factor
+  return options
+
+
+def usePadCollate(args):
+  """
+    Training batches are padded per batch when bucketing by caption length or sorting them when collating
+    :param args: Argument Parser object with definitions set in a specified config file
+  """
+  return args.bucket_batches or args.presort_batches
+
+
+def setupTrainLoader(args, dataset):
+  """
+    Create the training data loader, optionally grouping captions of similar length in the same batch
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param dataset: training dataset
+  """
+  if not usePadCollate(args):
+    return DataLoader(dataset, batch_size=args.batch_size, shuffle=True, **getLoaderOptions(args))
+
+  collate = PadCollate(dataset.word2idx['<pad>'], sort=args.presort_batches)
+
+  if args.bucket_batches:
+    sampler = BucketBatchSampler(dataset.getCaptionLengths(), args.batch_size, args.bucket_size_multiplier)
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate, **getLoaderOptions(args))
+
+  return DataLoader(dataset, batch_size=args.batch_size, shuffle=True, collate_fn=collate, **getLoaderOptions(args))
+
+
+def setupFeatureDataLoaders(args, encoder, transform):
+  """
+    Create the data loaders which read the encoded images from the feature store, building the stores
+    missing for the current encoder
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model
+    :param transform: transform applied to the images when building a store
+  """
+  if encoder is None:
+    raise ValueError("The encoder is required to use the feature store")
+
+  if (args.runType == "Testing"):
+    testStorePath = setupFeatureStore(args, encoder, "Test", args.encodedTestCaptionsPath,
+      args.encodedTestCaptionsLengthsPath, args.testImgsPath, transform, args.testCaptionStorePath, args.testImgsManifestPath,
+      args.testImgsShardsPath)
+    testLoader = DataLoader(FeatureXRayDataset(args.word2idxPath, args.encodedTestCaptionsPath,
+      args.encodedTestCaptionsLengthsPath, testStorePath, captionStorePath=args.testCaptionStorePath),
+      batch_size=args.batch_size, shuffle=True, **getLoaderOptions(args))
+
+    return testLoader, None
+
+  elif (args.runType == "Training"):
+    trainStorePath = setupFeatureStore(args, encoder, "Train", args.encodedTrainCaptionsPath,
+         args.encodedTrainCaptionsLengthsPath, args.trainImgsPath, transform, args.trainCaptionStorePath, args.trainImgsManifestPath,
+         args.trainImgsShardsPath)
+
+    trainLoader = setupTrainLoader(args, FeatureXRayDataset(args.word2idxPath, args.encodedTrainCaptionsPath,
+         args.encodedTrainCaptionsLengthsPath, trainStorePath, padCaptions=not usePadCollate(args),
+         captionStorePath=args.trainCaptionStorePath))
+    valLoader = setupValLoader(args, encoder)
+
+    return trainLoader, valLoader
+
+
+def setupFeatureStore(args, encoder, split, captionsPath, captionsLengthsPath, imgsPath, transform,
+                      captionStorePath=None, manifestPath=None, shardsPath=None):
+  """
+    Get the path of the feature store of a split for the given encoder, building it if it does not exist.
+    Stores built with another encoder (name or weights) or from other images (shards, image size) are not used.
+    :param args: Argument Parser object with definitions set in a specified config file
+    :param encoder: encoder model
+    :param split: Train / Val / Test
+  """
+  source = imageSource(imgsPath, transform, shardsPath)
+  fingerprint = encoderFingerprint(encoder, args.encoder_name, source)
+  storePath = getFeatureStorePath(args, split, fingerprint)
+
+  if not isFeatureStoreValid(storePath, fingerprint):
+    loader = DataLoader(XRayDataset(args.word2idxPath, captionsPath, captionsLengthsPath, imgsPath, transform,
+      captionStorePath=captionStorePath, manifestPath=manifestPath, shardsPath=shardsPath), batch_size=args.batch_size,
+      shuffle=False, **getLoaderOptions(args))
+    buildFeatureStore(args, encoder, loader, storePath, fingerprint, source)
+
+  return storePath
+
+
 
 def initializeTrainingEnvironment(args):
   return TrainingEnvironment(args)
@@ -2,6 +2,11 @@ import torch
 import torch.nn as nn
 from torch.nn.utils.rnn import pack_padded_sequence
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+import sys
+sys.path.append('../Models/')
+
+from NearestWordIndex import NearestWordIndex
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -9,6 +14,53 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
 
+def sentenceMeans(embeddings, decode_lengths):
+    '''
+      Mean of the embeddings of each caption over its decoded steps
+      :param embeddings: embeddings, a tensor of dimensions (batch_size, max_decode_length, embedding_dim)
+      :param decode_lengths: decode length of each caption
+      :return: sentence embeddings, a tensor of dimensions (batch_size, embedding_dim)
+    '''
+    lengths = torch.as_tensor(decode_lengths, device=embeddings.device)
+    mask = torch.arange(embeddings.size(1), device=embeddings.device).unsqueeze(0) < lengths.unsqueeze(1)
+    return (embeddings * mask.unsqueeze(2)).sum(dim=1) / lengths.unsqueeze(1).to(embeddings.dtype)
+
+
+
+class ChunkedSoftmaxCrossEntropyLoss(nn.Module):
+    '''
+      Cross entropy of the output layer of the Softmax decoder, computed from its inputs (the decoder hidden
+      states) in chunks of rows. The logits of a chunk are freed after its loss is summed and recomputed in the
+      backward pass, so the (words, vocab_size) logits are never stored. Same value as nn.CrossEntropyLoss
+      applied to the output layer.
+    '''
+
+    def __init__(self, chunk_size=1024):
+      super(ChunkedSoftmaxCrossEntropyLoss, self).__init__()
+      self.chunk_size = chunk_size
+
+
+    @staticmethod
+    def chunk_loss(hidden, weight, bias, targets):
+      return F.cross_entropy(F.linear(hidden, weight, bias), targets, reduction='sum')
+
+
+    def forward(self, hidden, fc, targets):
+      '''
+      :param hidden: inputs of the output layer, a tensor of dimensions (words, decoder_dim)
+      :param fc: output layer, a nn.Linear(decoder_dim, vocab_size)
+      :param targets: target word indexes, a tensor of dimensions (words)
+      :return: mean loss across all words
+      '''
+      loss = 0.
+      for start in range(0, hidden.size(0), self.chunk_size):
+        end = start + self.chunk_size
+        loss = loss + checkpoint(self.chunk_loss, hidden[start:end], fc.weight, fc.bias, targets[start:end],
+                                 use_reentrant=False)
+      return loss / hidden.size(0)
+
+
+
 class CosineEmbedLoss(nn.Module):
     '''
       Uses pytorch's cosine embedding loss. Class created to abstract need of
@@ -52,6 +104,8 @@ class SmoothL1LossWord(nn.Module):
 
 class SmoothL1LossWordAndSentence(nn.Module):
     '''
+      SmoothL1 loss of the words plus SmoothL1 loss of the sentence embeddings (mean of the word embeddings
+      of each caption).
     '''
 
     def __init__(self, beta=0.5):
@@ -62,83 +116,86 @@ class SmoothL1LossWordAndSentence(nn.Module):
 
     def forward(self, preds, targets, decode_lengths):
 
-      word_loss = 0.
-      sentence_loss = 0.
-      batch_size = targets.shape[0]
-      for sentence_idx in range(batch_size):
-          #word_loss += self.criterion(preds[sentence_idx, :decode_lengths[sentence_idx],:], targets[sentence_idx, :decode_lengths[sentence_idx],:])
-          
-          #preds_sum = torch.sum(preds[sentence_idx, :decode_lengths[sentence_idx],:], dim=0)
-          #print("preds_sum shape", preds_sum.shape)
-          
-          #print(torch.mean(preds[sentence_idx, :decode_lengths[sentence_idx],:], dim= 0).shape)
-
-          sentence_loss += self.criterion(torch.mean(preds[sentence_idx, :decode_lengths[sentence_idx],:], dim= 0),
-                                          torch.mean(targets[sentence_idx, :decode_lengths[sentence_idx],:], dim=0))
-
+      # Mean of the per caption losses, each a mean across embedding_dim
+      sentence_loss = self.criterion(sentenceMeans(preds, decode_lengths), sentenceMeans(targets, decode_lengths))
 
       preds = pack_padded_sequence(preds, decode_lengths, batch_first=True)
       targets = pack_padded_sequence(targets, decode_lengths, batch_first=True)
       loss = self.criterion(preds.data, targets.data)
-      print("LOSS:", loss)
-      print("sentence loss:", sentence_loss)
 
-
-      #return  word_loss /batch_size +  (sentence_loss / batch_size)
-      return loss + sentence_loss / batch_size
+      return loss + sentence_loss
 
 class SyntheticTripletLoss(nn.Module):
     """
-    Triplet margin Loss using syntethically created negative examples
+    Triplet margin Loss using syntethically created negative examples or hard negatives mined from the vocabulary
 
     """
 
-    def __init__(self, margin=0.5, mode='Ortho'):
+    def __init__(self, margin=0.5, mode='Ortho', embeddings=None, nr_negatives=10):
+      '''
+      :param margin: triplet margin
+      :param mode: negative sampling mode: Ortho, Diff or MINS (most similar vocabulary embeddings to the target)
+      :param embeddings: embeddings matrix (vocab_size, embedding_dim), required by the MINS mode
+      :param nr_negatives: number of vocabulary embeddings mined per target in the MINS mode
+      '''
       super(SyntheticTripletLoss, self).__init__()
+      if mode not in ['Ortho', 'Diff', 'MINS']:
+        raise ValueError("Unknown triplet loss mode " + str(mode) + ", expected Ortho, Diff or MINS")
+      if mode == 'MINS' and embeddings is None:
+        raise ValueError("The MINS triplet loss mode requires the embeddings matrix")
+
       self.margin = margin
       self.mode = mode
+      self.nr_negatives = nr_negatives
+      self.nearest_words = NearestWordIndex(embeddings) if mode == 'MINS' else None
 
 
     def forward(self, preds, targets, decode_lengths):
       '''
-      Can create synthetic examples based on an orthogonal or subtraction basis
-      :param targets: target embeddings, a tensor of dimensions (sum length captions in batch, embedding_dim)
-      :param preds: predicted embeddings, a tensor of dimensions (sum length captions in batch, embedding_dim)
+      Can create synthetic examples based on an orthogonal or subtraction basis, or use the hardest of the
+      vocabulary embeddings most similar to each target. Every similarity is computed row-wise, so memory is
+      linear in the number of words.
+      :param targets: target embeddings, a tensor of dimensions (batch_size, max_decode_length, embedding_dim)
+      :param preds: predicted embeddings, a tensor of dimensions (batch_size, max_decode_length, embedding_dim)
       :return: mean loss across all words
       '''
 
       preds = pack_padded_sequence(preds, decode_lengths, batch_first=True).data
       targets = pack_padded_sequence(targets, decode_lengths, batch_first=True).data
 
+      # embeddings normalized -> cosine sim = dot product
+      simPredToTarget = (preds * targets).sum(dim=1)  # (words)
+
       # Create a negative example by projecting the predicted embedding to the target embedding and use that
       # to find component of the pred embedding orthogonal to the target embedding
       # û− (û.T dotprod u)u   ---- û: pred embedding, u: target embedding
       if self.mode == 'Ortho':
-        negSamples = preds - torch.mm(preds, targets.T).diag().unsqueeze(1).expand(targets.shape[0], targets.shape[1]) * targets
+        negSamples = preds - simPredToTarget.unsqueeze(1) * targets
 
       # Create negative sample by subtraction
       # û - u  ----û: pred embedding, u: target embedding
       elif self.mode == 'Diff':
         negSamples = preds - targets
 
-      negSamples = torch.nn.functional.normalize(negSamples, p=2, dim=1)
-      # embeddings normalized -> cosine sim = dot product
-      simPredToTarget = torch.mm(preds, targets.T).diag()
-      simPredToNegSample = torch.mm(preds, negSamples.T).diag()
+      if self.mode == 'MINS':
+        # The nr_negatives vocabulary embeddings closest to each target, besides the target itself, in one
+        # batched query; the hardest of them for the prediction is the negative example
+        # Rebuilt only if the embeddings were fine-tuned since the last batch
+        self.nearest_words.update(self.nearest_words.source)
+        simToTarget, candidates = self.nearest_words.topk(targets, self.nr_negatives + 1)  # (words, nr_negatives + 1)
+        negSamples = self.nearest_words.weight[candidates]  # (words, nr_negatives + 1, embedding_dim)
 
-      #marginT = torch.ones(targets.shape[0]).to(device)
-      #marginT = marginT.new_full((targets.shape[0],), self.margin, dtype=torch.float, device=device, requires_grad=False)
+        simPredToNegSample = torch.bmm(negSamples, preds.unsqueeze(2)).squeeze(2)  # (words, nr_negatives + 1)
+        simPredToNegSample = simPredToNegSample.masked_fill(simToTarget > 1. - 1e-4, float('-inf'))
+        simPredToNegSample = simPredToNegSample.max(dim=1)[0]
+      else:
+        negSamples = torch.nn.functional.normalize(negSamples, p=2, dim=1)
+        simPredToNegSample = (preds * negSamples).sum(dim=1)
 
-      lossPerWord = self.margin + simPredToNegSample - simPredToTarget
-      lossPerWord[lossPerWord<0] = 0 # Max(0, loss)
+      # Max(0, loss)
+      lossPerWord = torch.clamp(self.margin + simPredToNegSample - simPredToTarget, min=0)
 
-      loss = torch.mean(lossPerWord).item()
-
-      #If using L2, can just apply pytorch function?
-      # triplet_loss = torch.nn.TripletMarginLoss(margin=1.0, p=2.0)
-      #output = triplet_loss(marginT, positive, negSamples)
-
-      return loss
+      return torch.mean(lossPerWord)
 
 
 
@@ -208,8 +265,8 @@ class SyntheticTripletLossSmoothL1Sentence(nn.Module):
 
 class SmoothL1LossWordAndSentenceAndImage(nn.Module):
     '''
-      Uses pytorch's cosine embedding loss. Class created to abstract need of
-      using a y vector.
+      SmoothL1 loss of the words, of the sentence embeddings (mean of the word embeddings of each caption) and
+      of the predicted and target sentence embeddings to the image embedding.
     '''
 
     def __init__(self, beta=0.5):
@@ -220,29 +277,18 @@ class SmoothL1LossWordAndSentenceAndImage(nn.Module):
 
     def forward(self, preds, targets,  decode_lengths):
 
-      word_loss = 0.
-      sentence_loss = 0.
-      pred_image_embedding_loss = 0.
-      target_image_embedding_loss = 0.
-
-      batch_size = targets[0].shape[0]
-      for sentence_idx in range(batch_size):
-          #word_loss += self.criterion(preds[sentence_idx, :decode_lengths[sentence_idx],:], targets[0][sentence_idx, :decode_lengths[sentence_idx],:])
-          pred_sentence_mean = torch.mean(preds[sentence_idx, :decode_lengths[sentence_idx],:], dim=0)
-          target_sentence_mean = torch.mean(targets[0][sentence_idx, :decode_lengths[sentence_idx],:], dim=0)
-          #print(targets[1].shape)
-          #print(targets[1])
-          normalized_img_embedding = torch.nn.functional.normalize(targets[1][sentence_idx], p=2, dim=0)
-
-          sentence_loss += self.criterion(pred_sentence_mean,target_sentence_mean)
-
-          pred_image_embedding_loss += self.criterion(pred_sentence_mean, normalized_img_embedding)
+      pred_sentence_means = sentenceMeans(preds, decode_lengths)
+      target_sentence_means = sentenceMeans(targets[0], decode_lengths)
+      normalized_img_embeddings = torch.nn.functional.normalize(targets[1], p=2, dim=1)
 
-          target_image_embedding_loss += self.criterion(target_sentence_mean, normalized_img_embedding)
+      # Means of the per caption losses, each a mean across embedding_dim
+      sentence_loss = self.criterion(pred_sentence_means, target_sentence_means)
+      pred_image_embedding_loss = self.criterion(pred_sentence_means, normalized_img_embeddings)
+      target_image_embedding_loss = self.criterion(target_sentence_means, normalized_img_embeddings)
 
       preds = pack_padded_sequence(preds, decode_lengths, batch_first=True)
       targets = pack_padded_sequence(targets[0], decode_lengths, batch_first=True)
       loss = self.criterion(preds.data, targets.data)
 
 
-      return  loss + (sentence_loss / batch_size) + pred_image_embedding_loss /batch_size + target_image_embedding_loss /batch_size
+      return  loss + sentence_loss + pred_image_embedding_loss + target_image_embedding_loss